@@ -1,32 +1,114 @@
+import time
+_import_started = time.perf_counter()
+
+import click
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
+from flask_jwt_extended.exceptions import JWTExtendedException
 from flask_restx import Api
 from flask_mail import Mail
+from jwt import PyJWTError
 from config import Config
+from .hashing import PasswordHasher
+from .shared import SharedState
+from .revocation import RevocationStore
+from .cache import Cache
+from .metrics import Metrics
+from .profiling import QueryProfiler
+from .mailer import MailQueue
+from .audit import AuditLog
+from .purge import UserPurge
+from .ratelimit import RateLimiter
+from .serialization import Serializer
+from .compression import Compressor
+from .startup import Startup, StartupReport
 
 mail = Mail()
+mail_queue = MailQueue()
+audit = AuditLog()
+user_purge = UserPurge()
 db = SQLAlchemy()
-migrate = Migrate()
 jwt = JWTManager()
+hasher = PasswordHasher()
+shared = SharedState()
+revocations = RevocationStore()
+cache = Cache()
+metrics = Metrics()
+profiler = QueryProfiler()
+limiter = RateLimiter()
+serializer = Serializer()
+compressor = Compressor()
+startup = Startup()
 api = Api(
     title='User Management API',
     version='1.0',
     description='A user management API with Flask-RESTX'
 )
 
+
+@api.errorhandler(JWTExtendedException)
+@api.errorhandler(PyJWTError)
+def jwt_error(error):
+    '''Answer JWT errors with Flask-JWT-Extended's 401/422 responses.
+
+    Flask-RESTX handles exceptions raised in its resources before the app's
+    error handlers run, and would turn a revoked or expired token into a 500.
+    Raising from here makes it fall back to the app's handlers, where
+    Flask-JWT-Extended registered its own.
+    '''
+    raise error
+
+_imported = time.perf_counter()
+
+def init_migrate(app):
+    # Flask-Migrate imports alembic, which only `flask db` needs.
+    from flask_migrate import Migrate
+    Migrate(app, db)
+
 def create_app():
-    app = Flask(__name__)
-    app.config.from_object(Config)
-    
-    db.init_app(app)
-    migrate.init_app(app, db)
-    jwt.init_app(app)
-    mail.init_app(app)
-    api.init_app(app)
-    
+    report = StartupReport(_import_started)
+    report.add('import', _imported - _import_started)
+    with report.phase('config'):
+        app = Flask(__name__)
+        app.config.from_object(Config)
+    proxies = app.config.get('TRUSTED_PROXIES', 0)
+    if proxies:
+        # request.remote_addr (rate limits, audit log) becomes the client's address.
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+    production = app.config.get('PRODUCTION_MODE', False)
+
+    from . import pool
+    extensions = [('pool', pool.init_app), ('db', db.init_app)]
+    if not production or click.get_current_context(silent=True) is not None:
+        extensions.append(('migrate', init_migrate))
+    extensions.append(('jwt', jwt.init_app))
+    if not production:
+        # In production mode the mail queue sets Flask-Mail up on first delivery.
+        extensions.append(('mail', mail.init_app))
+    extensions += [
+        ('mail_queue', mail_queue.init_app),
+        ('audit', audit.init_app),
+        ('user_purge', user_purge.init_app),
+        ('hasher', hasher.init_app),
+        ('shared', shared.init_app),
+        ('revocations', revocations.init_app),
+        ('cache', cache.init_app),
+        ('metrics', metrics.init_app),
+        ('profiler', profiler.init_app),
+        ('limiter', limiter.init_app),
+        ('serializer', serializer.init_app),
+        ('compressor', compressor.init_app),
+        ('api', api.init_app),
+    ]
+    for name, init_app in extensions:
+        with report.phase(name):
+            init_app(app)
+
     from .routes import register_routes
-    register_routes(api)
-    
-    return app
\ No newline at end of file
+    with report.phase('routes'):
+        register_routes(api)
+
+    startup.init_app(app, report)
+    return app
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from types import SimpleNamespace
+from asgiref.wsgi import WsgiToAsgi
+from flask_jwt_extended import decode_token
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from . import api, audit, cache, hasher, limiter, revocations, serializer, shared
+from .cache import MemoryBackend, profile_key
+from .conditional import not_modified, pack, unpack, validators
+from .hashing import HashingBusy
+from .metrics import REQUEST_SECONDS, REQUESTS
+from .models import User
+from .ratelimit import MemoryBackend as MemoryLimits
+from .revocation import MemoryBackend as MemoryRevocations
+from .routes import invalid_payload
+from .utils import create_tokens
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+USER_PATH = re.compile(r'^/user/([^/]+)$')
+
+
+def async_database_url(uri):
+    url = make_url(uri)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    return url.set(drivername=driver) if driver else None
+
+
+def client_address(scope, trusted_proxies=0):
+    '''Client IP of an ASGI request, resolved from X-Forwarded-For like ProxyFix.'''
+    client = (scope.get('client') or (None,))[0]
+    if trusted_proxies:
+        forwarded = b','.join(value for name, value in scope['headers'] if name == b'x-forwarded-for')
+        hops = forwarded.decode('latin-1').split(',')
+        if forwarded and len(hops) >= trusted_proxies:
+            client = hops[-trusted_proxies].strip()
+    return client
+
+
+class AsyncUserApp:
+    '''ASGI front for the Flask app.
+
+    GET /user/<username> and POST /user/login are served natively on the
+    event loop with an async engine, and password checks are awaited from
+    the hashing pool. Everything else goes to the Flask app through asgiref's
+    WSGI adapter, which runs it in a thread pool.
+    '''
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+        self.static_paths = {rule.rule for rule in flask_app.url_map.iter_rules() if not rule.arguments}
+        config = flask_app.config
+        self.trusted_proxies = config.get('TRUSTED_PROXIES', 0)
+        url = async_database_url(config['SQLALCHEMY_DATABASE_URI'])
+        self.engine = None
+        if url is not None:
+            options = {'pool_pre_ping': config.get('DB_POOL_PRE_PING', True)}
+            if url.get_backend_name() != 'sqlite':
+                options.update(
+                    pool_size=config.get('DB_POOL_SIZE', 10),
+                    max_overflow=config.get('DB_MAX_OVERFLOW', 5),
+                    pool_timeout=config.get('DB_POOL_TIMEOUT', 5),
+                    pool_recycle=config.get('DB_POOL_RECYCLE', 1800),
+                )
+            self.engine = create_async_engine(url, **options)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and self.engine is not None:
+            path, method = scope['path'], scope['method']
+            if method == 'POST' and path == '/user/login':
+                return await self.timed('user_user_login', scope, send, self.login(scope, receive))
+            match = USER_PATH.match(path)
+            if method == 'GET' and match and path not in self.static_paths:
+                return await self.timed('user_user_resource', scope, send, self.get_user(scope, match.group(1)))
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                shared.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.engine is not None:
+                    await self.engine.dispose()
+                hasher.shutdown()
+                await asyncio.to_thread(audit.flush)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def timed(self, endpoint, scope, send, handler):
+        start = time.perf_counter()
+        try:
+            status, body, headers = await handler
+        except Exception as e:
+            # As the Flask handlers do, answer in JSON and still count the request.
+            logger.exception("Error in %s %s", scope['method'], scope['path'])
+            status, body, headers = 500, {'msg': f"An error occurred: {str(e)}"}, {}
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, method=scope['method'])
+        REQUESTS.inc(endpoint=endpoint, method=scope['method'], status=status)
+        if status == 304:
+            body, content = b'', []
+        else:
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode()
+            content = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': content + [(name.encode(), value.encode()) for name, value in headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def get_user(self, scope, username):
+        '''Get user details'''
+        headers = dict(scope['headers'])
+        authorization = headers.get(b'authorization', b'').decode()
+        if not authorization.startswith('Bearer '):
+            return 401, {'msg': "Missing Authorization Header"}, {}
+        with self.flask_app.app_context():
+            try:
+                payload = decode_token(authorization[len('Bearer '):])
+            except Exception as e:
+                return 401, {'msg': str(e)}, {}
+            if payload.get('type') != 'access':
+                return 422, {'msg': "Only non-refresh tokens are allowed"}, {}
+        if isinstance(revocations.backend, MemoryRevocations) and revocations._warmed:
+            revoked = revocations.is_revoked(payload)
+        else:
+            revoked = await asyncio.to_thread(self.in_app_context, revocations.is_revoked, payload)
+        if revoked:
+            return 401, {'msg': "Token has been revoked"}, {}
+        current_user = payload[self.flask_app.config.get('JWT_IDENTITY_CLAIM', 'sub')]
+        if current_user['role'] != 'ADMIN' and current_user['username'] != username:
+            return 403, {'message': "Permission denied."}, {}
+
+        key = profile_key(username)
+        conditions = [headers[name].decode() if name in headers else None
+                      for name in (b'if-none-match', b'if-modified-since')]
+        entry = await self.cache_call(cache.get, key)
+        if entry is not None:
+            etag, last_modified, body = unpack(entry)
+        else:
+            generation = await self.cache_call(cache.generation, key)
+            live = (User.username == username, User.deleted_at.is_(None))
+            async with self.engine.connect() as connection:
+                if any(conditions):
+                    row = (await connection.execute(select(User.id, User.updated_at).where(*live))).first()
+                    if row is None:
+                        return 404, {'message': "User not found."}, {}
+                    etag, last_modified = validators(row.id, row.updated_at)
+                    if not_modified(*conditions, etag, last_modified):
+                        return 304, b'', {'ETag': etag, 'Last-Modified': last_modified}
+                row = (await connection.execute(select(
+                    User.id, User.username, User.first_name, User.last_name,
+                    User.email, User.role, User.active, User.updated_at
+                ).where(*live))).first()
+            if row is None:
+                return 404, {'message': "User not found."}, {}
+            body = serializer.dump(api.models['User'], row)
+            etag, last_modified = validators(row.id, row.updated_at)
+            await self.cache_call(cache.set, key, pack(etag, last_modified, body), generation)
+        validator_headers = {'ETag': etag, 'Last-Modified': last_modified}
+        if not_modified(*conditions, etag, last_modified):
+            return 304, b'', validator_headers
+        return 200, body, validator_headers
+
+    async def login(self, scope, receive):
+        '''Login and receive an access token'''
+        try:
+            data = json.loads(await read_body(receive))
+        except ValueError:
+            return 400, {'msg': "Request body must be JSON with username and password."}, {}
+
+        client = client_address(scope, self.trusted_proxies)
+        if limiter.enabled:
+            # Same keys as RateLimiter.limit: the username only counts when it is a string.
+            config = self.flask_app.config
+            username = data.get('username') if isinstance(data, dict) else None
+            keys = [('ip', client or '-')]
+            if isinstance(username, str) and username:
+                keys.append(('username', username.lower()))
+            for key_type, key in keys:
+                limit = config.get(f'RATELIMIT_LOGIN_PER_{key_type.upper()}')
+                retry_after = limit and await self.limiter_check('login', key_type, key, limit)
+                if retry_after:
+                    return 429, {'msg': "Too many requests, please retry later."}, {'Retry-After': str(retry_after)}
+
+        errors = serializer.validator(api.models['Login'])(data)
+        if not errors:
+            # The model validator lets null through, and neither may be null here.
+            errors = {key: "None is not of type 'str'" for key in ('username', 'password') if data[key] is None}
+        if errors:
+            body, status = invalid_payload(errors)
+            return status, body, {}
+        username, password = data['username'], data['password']
+
+        query = select(
+            User.id, User.username, User.role, User.active, User.password_hash, User.token_version
+        ).where(User.username == username, User.deleted_at.is_(None))
+        async with self.engine.connect() as connection:
+            user = (await connection.execute(query)).first()
+        if user and not user.active:
+            await self.audit_record('login_failed', user.id, ip=client, reason='inactive')
+            return 401, {'msg': "Your account is deactivated."}, {}
+        try:
+            verified = user is not None and await asyncio.get_running_loop().run_in_executor(
+                None, hasher.verify, user.password_hash, password)
+        except HashingBusy as e:
+            return 503, {'msg': "Server is busy, please retry later."}, {'Retry-After': str(e.retry_after)}
+        if not verified:
+            await self.audit_record('login_failed', user.id if user else None, ip=client, username=username)
+            return 401, {'msg': "Invalid username or password."}, {}
+
+        with self.flask_app.app_context():
+            if hasher.needs_rehash(user.password_hash):
+                hasher.rehash_in_background(SimpleNamespace(id=user.id, password_hash=user.password_hash), password)
+            tokens = create_tokens(user)
+        await self.audit_record('login', user.id, user.id, ip=client)
+        return 200, {'msg': "Login successful.", **tokens}, {}
+
+    def in_app_context(self, fn, *args):
+        with self.flask_app.app_context():
+            return fn(*args)
+
+    async def cache_call(self, fn, *args):
+        if isinstance(cache.backend, MemoryBackend):
+            return fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    async def limiter_check(self, *args):
+        if isinstance(limiter.backend, MemoryLimits):
+            return limiter.check(*args)
+        return await asyncio.to_thread(limiter.check, *args)
+
+    async def audit_record(self, *args, **details):
+        # record() waits up to AUDIT_BLOCK_TIMEOUT for room when the buffer is full.
+        return await asyncio.to_thread(audit.record, *args, **details)
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+def create_asgi_app(flask_app=None):
+    if flask_app is None:
+        from . import create_app
+        flask_app = create_app()
+    return AsyncUserApp(flask_app)
@@ -0,0 +1,218 @@
+import atexit
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+import click
+from flask import has_request_context, request
+from flask.cli import AppGroup
+from sqlalchemy.exc import DBAPIError
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+AUDIT_EVENTS = registry.counter(
+    'audit_events_total', 'Audit events by outcome: buffered, written or dropped.', ('outcome',))
+
+
+def month_start(day, months=0):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def create_partitions(connection, months=3, start=None):
+    '''Create monthly audit_event partitions from start's month onward (Postgres only).
+
+    Has to run ahead of time: rows that land in the default partition block
+    creating the partition for their month. The audit writer thread does
+    this hourly for the current and the next month.
+    '''
+    if connection.dialect.name != 'postgresql':
+        return []
+    start = month_start(start or date.today())
+    created = []
+    for offset in range(months):
+        low, high = month_start(start, offset), month_start(start, offset + 1)
+        name = f'audit_event_y{low.year}m{low.month:02d}'
+        connection.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF audit_event "
+            f"FOR VALUES FROM ('{low.isoformat()}') TO ('{high.isoformat()}')"
+        )
+        created.append(name)
+    return created
+
+
+class AuditLog:
+    '''Append-only audit trail written off the request path.
+
+    record() puts the event in a bounded in-memory buffer and returns; a
+    background thread inserts the buffer in batches of AUDIT_BATCH_SIZE every
+    AUDIT_FLUSH_INTERVAL seconds, or sooner once a batch is ready. When the
+    buffer is full, record() waits up to AUDIT_BLOCK_TIMEOUT for the writer
+    to make room and then drops the event, so a slow database slows requests
+    down by a bounded amount instead of growing memory without limit.
+    '''
+
+    PARTITION_CHECK_INTERVAL = 3600
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.capacity = 10000
+        self.batch_size = 500
+        self.flush_interval = 1.0
+        self.block_timeout = 0.05
+        self.dropped = 0
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._partitions_checked_at = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('AUDIT_ENABLED', True)
+        self.capacity = app.config.get('AUDIT_BUFFER_SIZE', 10000)
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', 500)
+        self.flush_interval = app.config.get('AUDIT_FLUSH_INTERVAL', 1.0)
+        self.block_timeout = app.config.get('AUDIT_BLOCK_TIMEOUT', 0.05)
+        app.extensions['audit_log'] = self
+        app.cli.add_command(audit_cli)
+
+    def record(self, action, user_id=None, actor_id=None, ip=None, **details):
+        '''Buffer one event about user_id, done by actor_id. Returns False if dropped.'''
+        return self.record_many(action, [user_id], actor_id, ip, **details) == 1
+
+    def record_many(self, action, user_ids, actor_id=None, ip=None, **details):
+        '''Buffer the same event for several users. Returns how many were kept.'''
+        if not self.enabled:
+            return 0
+        now = datetime.utcnow()
+        if ip is None and has_request_context():
+            ip = request.remote_addr
+        # Round-trip now so one odd value cannot fail a whole batch at flush time.
+        details = json.loads(json.dumps(details, default=str)) if details else None
+        events = [{'created_at': now, 'user_id': user_id, 'actor_id': actor_id, 'action': action,
+                   'ip': ip, 'details': details} for user_id in user_ids]
+        self._start()
+        kept = 0
+        deadline = None
+        with self._cond:
+            for event in events:
+                while len(self._buffer) >= self.capacity:
+                    deadline = deadline or time.monotonic() + self.block_timeout
+                    remaining = deadline - time.monotonic()
+                    self._cond.notify_all()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        break
+                if len(self._buffer) >= self.capacity:
+                    break
+                self._buffer.append(event)
+                kept += 1
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+        if kept:
+            AUDIT_EVENTS.inc(kept, outcome='buffered')
+        if kept < len(events):
+            self.dropped += len(events) - kept
+            AUDIT_EVENTS.inc(len(events) - kept, outcome='dropped')
+            logger.warning("Audit buffer full, dropped %d %s event(s)", len(events) - kept, action)
+        return kept
+
+    def pending(self):
+        return len(self._buffer)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-log', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._buffer) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+            try:
+                self._ensure_partitions()
+            except Exception:
+                logger.exception("Creating audit_event partitions failed")
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Audit log flush failed")
+                time.sleep(self.flush_interval)
+
+    def _ensure_partitions(self):
+        '''Keep this month's and next month's partitions in place, checked hourly.'''
+        now, checked_at = time.monotonic(), self._partitions_checked_at
+        if checked_at is not None and now - checked_at < self.PARTITION_CHECK_INTERVAL:
+            return
+        self._partitions_checked_at = now
+        from . import db
+        with self.app.app_context():
+            if db.engine.dialect.name != 'postgresql':
+                return
+            with db.engine.begin() as connection:
+                # Creating a partition locks audit_event; never queue inserts behind a long wait.
+                connection.exec_driver_sql("SET LOCAL lock_timeout = '2s'")
+                create_partitions(connection, months=2)
+
+    def flush(self):
+        '''Write everything buffered so far. Returns how many events were written.'''
+        from . import db
+        from .models import AuditEvent
+        written = 0
+        while True:
+            with self._cond:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                self._cond.notify_all()
+            if not batch:
+                return written
+            try:
+                with self.app.app_context():
+                    db.session.execute(db.insert(AuditEvent), batch)
+                    db.session.commit()
+            except DBAPIError:
+                with self._cond:
+                    # Put the batch back in front for the next attempt; whatever
+                    # no longer fits is lost.
+                    room = max(0, self.capacity - len(self._buffer))
+                    self._buffer.extendleft(reversed(batch[:room]))
+                if len(batch) > room:
+                    self.dropped += len(batch) - room
+                    AUDIT_EVENTS.inc(len(batch) - room, outcome='dropped')
+                raise
+            except Exception:
+                # Not a database problem, so retrying the same rows cannot help.
+                self.dropped += len(batch)
+                AUDIT_EVENTS.inc(len(batch), outcome='dropped')
+                raise
+            written += len(batch)
+            AUDIT_EVENTS.inc(len(batch), outcome='written')
+
+
+audit_cli = AppGroup('audit', help='Audit log commands.')
+
+
+@audit_cli.command('flush')
+def flush_command():
+    '''Write buffered audit events, then exit.'''
+    from . import audit
+    click.echo(f'Wrote {audit.flush()} event(s).')
+
+
+@audit_cli.command('partitions')
+@click.option('--months', default=3, show_default=True, help='Months to create, starting with the current one.')
+def partitions_command(months):
+    '''Create upcoming monthly audit_event partitions (Postgres).'''
+    from . import db
+    with db.engine.begin() as connection:
+        created = create_partitions(connection, months)
+    click.echo(f"Ensured {len(created)} partition(s): {', '.join(created) or 'none needed'}.")
@@ -0,0 +1,225 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBackend:
+    '''LRU cache of byte payloads bounded by entry count and total size.
+
+    Deletes bump a generation counter for the key's stripe (and clear() bumps
+    them all), so a set() guarded by a generation read before the database
+    was queried is dropped if the key was invalidated in between.
+    '''
+
+    STRIPES = 1024
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._size = 0
+        self._epoch = 0
+        self._generations = [0] * self.STRIPES
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at and expires_at < time.monotonic():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def generation(self, key):
+        with self._lock:
+            return self._generation(key)
+
+    def _generation(self, key):
+        return self._epoch, self._generations[hash(key) % self.STRIPES]
+
+    def set(self, key, value, ttl=None, generation=None):
+        if len(value) > self.max_bytes:
+            return
+        expires_at = time.monotonic() + ttl if ttl else 0
+        with self._lock:
+            if generation is not None and generation != self._generation(key):
+                return
+            self._pop(key)
+            self._data[key] = (expires_at, value)
+            self._size += len(value)
+            while self._data and (len(self._data) > self.max_entries or self._size > self.max_bytes):
+                self._pop(next(iter(self._data)))
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._generations[hash(key) % self.STRIPES] += 1
+                self._pop(key)
+
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._size -= len(item[1])
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+            self._epoch += 1
+
+    def info(self):
+        return {'entries': len(self._data), 'bytes': self._size}
+
+
+class RedisBackend:
+    '''Cache backed by any server speaking the Redis protocol.
+
+    Deletes increment a per-key generation, and a guarded set() watches it so
+    the write is dropped if the key was invalidated since it was read.
+    '''
+
+    # Only needs to outlive a read-through fill, not the entry itself.
+    GENERATION_TTL = 3600
+
+    def __init__(self, client, prefix='cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def generation(self, key):
+        return self.client.get(self.prefix + 'gen:' + key) or b''
+
+    def set(self, key, value, ttl=None, generation=None):
+        ex = int(ttl) if ttl else None
+        if generation is None:
+            self.client.set(self.prefix + key, value, ex=ex)
+            return
+        from redis.exceptions import WatchError
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(self.prefix + 'gen:' + key)
+                if (pipe.get(self.prefix + 'gen:' + key) or b'') != generation:
+                    return
+                pipe.multi()
+                pipe.set(self.prefix + key, value, ex=ex)
+                pipe.execute()
+            except WatchError:
+                pass
+
+    def delete(self, *keys):
+        if keys:
+            with self.client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.incr(self.prefix + 'gen:' + key)
+                    pipe.expire(self.prefix + 'gen:' + key, self.GENERATION_TTL)
+                pipe.delete(*[self.prefix + key for key in keys])
+                pipe.execute()
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+    def info(self):
+        return {}
+
+
+class NullBackend:
+    def get(self, key):
+        return None
+
+    def generation(self, key):
+        return None
+
+    def set(self, key, value, ttl=None, generation=None):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def info(self):
+        return {}
+
+
+class Cache:
+    '''Read-through cache for serialized API payloads.
+
+    The memory backend is local to each process, so delete() also publishes
+    the keys through the shared state and every other node drops its copy.
+    '''
+
+    def __init__(self, app=None):
+        self.backend = NullBackend()
+        self.ttl = 300
+        self.hits = 0
+        self.misses = 0
+        self.local = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from . import shared
+        kind = app.config.get('CACHE_BACKEND', 'memory')
+        if kind == 'memory':
+            self.backend = MemoryBackend(
+                max_entries=app.config.get('CACHE_MAX_ENTRIES', 10000),
+                max_bytes=app.config.get('CACHE_MAX_BYTES', 64 * 1024 * 1024)
+            )
+        elif kind == 'redis':
+            self.backend = RedisBackend(shared.redis_client(app.config.get('CACHE_REDIS_URL')))
+        else:
+            self.backend = NullBackend()
+        self.ttl = app.config.get('CACHE_TTL', 300)
+        self.local = kind == 'memory'
+        if self.local:
+            shared.subscribe('cache', self._invalidate)
+        app.extensions['cache'] = self
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def generation(self, key):
+        '''Token to read before loading a value and pass to set().
+
+        A delete() of the key in between, on this node or any other, makes
+        the guarded set() a no-op, so a fill racing a write cannot put the
+        stale value back.
+        '''
+        return self.backend.generation(key)
+
+    def set(self, key, value, generation=None):
+        self.backend.set(key, value, self.ttl, generation)
+
+    def delete(self, *keys):
+        self.backend.delete(*keys)
+        if self.local and keys:
+            from . import shared
+            shared.publish('cache', list(keys))
+
+    def _invalidate(self, keys):
+        # None: the subscription dropped and invalidations may have been missed.
+        if keys is None:
+            self.backend.clear()
+        else:
+            self.backend.delete(*keys)
+
+    def metrics(self):
+        return {'hits': self.hits, 'misses': self.misses, **self.backend.info()}
+
+
+def profile_key(username):
+    # v2 entries carry their ETag and Last-Modified (see conditional.pack).
+    return f'user:v2:{username}'
@@ -0,0 +1,140 @@
+import time
+import zlib
+from flask import request
+from .metrics import registry
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_BYTES = registry.counter(
+    'compression_bytes_total', 'Response bytes before (identity) and after compression, by encoding.',
+    ('encoding', 'stage'))
+
+
+class GzipEncoder:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliEncoder:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class Compressor:
+    '''Negotiated gzip/brotli compression of API responses.
+
+    Responses whose mimetype is in COMPRESS_MIMETYPES are encoded with the
+    client's preferred Accept-Encoding; brotli is offered only when the
+    brotli package is installed. Buffered bodies under COMPRESS_MIN_SIZE
+    bytes are sent as they are. Streamed bodies (NDJSON export and import)
+    are compressed chunk by chunk as they are produced, and the compressor
+    is flushed every COMPRESS_STREAM_FLUSH_SIZE input bytes, or when a chunk
+    arrives COMPRESS_STREAM_FLUSH_INTERVAL seconds after the last flush, so
+    the client keeps receiving data without the response being buffered.
+    '''
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.encoders = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config.get('COMPRESS_ENABLED', True)
+        self.min_size = config.get('COMPRESS_MIN_SIZE', 1024)
+        self.mimetypes = set(config.get('COMPRESS_MIMETYPES', ('application/json', 'application/x-ndjson')))
+        self.flush_size = config.get('COMPRESS_STREAM_FLUSH_SIZE', 16 * 1024)
+        self.flush_interval = config.get('COMPRESS_STREAM_FLUSH_INTERVAL', 0.2)
+        levels = {'gzip': config.get('COMPRESS_GZIP_LEVEL', 6)}
+        self.encoders = {'gzip': GzipEncoder}
+        if brotli is not None:
+            levels['br'] = config.get('COMPRESS_BROTLI_LEVEL', 4)
+            self.encoders = {'br': BrotliEncoder, 'gzip': GzipEncoder}
+        self.levels = levels
+        app.extensions['compressor'] = self
+        app.after_request(self._compress)
+
+    def encoder(self, encoding):
+        return self.encoders[encoding](self.levels[encoding])
+
+    def _compress(self, response):
+        if (not self.enabled or response.mimetype not in self.mimetypes
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(list(self.encoders))
+        if encoding is None or request.method == 'HEAD':
+            return response
+
+        if response.is_streamed:
+            response.response = self._stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            encoder = self.encoder(encoding)
+            body = encoder.compress(data) + encoder.finish()
+            if len(body) >= len(data):
+                return response
+            response.set_data(body)
+            COMPRESSION_BYTES.inc(len(data), encoding=encoding, stage='identity')
+            COMPRESSION_BYTES.inc(len(body), encoding=encoding, stage='encoded')
+
+        response.headers['Content-Encoding'] = encoding
+        # The encoded bytes differ from the identity ones, so a strong ETag no longer applies.
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _stream(self, chunks, encoding):
+        encoder = self.encoder(encoding)
+        pending = 0
+        flushed_at = time.monotonic()
+        size = encoded = 0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                size += len(chunk)
+                pending += len(chunk)
+                data = encoder.compress(chunk)
+                now = time.monotonic()
+                if pending >= self.flush_size or now - flushed_at >= self.flush_interval:
+                    data += encoder.flush()
+                    pending, flushed_at = 0, now
+                if data:
+                    encoded += len(data)
+                    yield data
+            data = encoder.finish()
+            encoded += len(data)
+            yield data
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+            COMPRESSION_BYTES.inc(size, encoding=encoding, stage='identity')
+            COMPRESSION_BYTES.inc(encoded, encoding=encoding, stage='encoded')
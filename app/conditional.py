@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag, unquote_etag
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def validators(user_id, updated_at):
+    '''Strong ETag and Last-Modified header values for a user row.
+
+    Every change to a user bumps updated_at, so (id, updated_at) identifies
+    the representation without serializing it.
+    '''
+    updated_at = updated_at or EPOCH
+    micros = (updated_at - EPOCH) // timedelta(microseconds=1)
+    return quote_etag(f'{user_id:x}-{micros:x}'), http_date(updated_at)
+
+
+def not_modified(if_none_match, if_modified_since, etag, last_modified):
+    '''Whether a GET with these headers gets a 304.
+
+    If-Modified-Since is ignored when If-None-Match is present (RFC 9110).
+    '''
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(unquote_etag(etag)[0])
+    if if_modified_since:
+        since = parse_date(if_modified_since)
+        return since is not None and parse_date(last_modified) <= since
+    return False
+
+
+def precondition_failed(if_match, etag):
+    '''Whether an If-Match header rules out the current ETag.'''
+    return bool(if_match) and not parse_etags(if_match).contains(unquote_etag(etag)[0])
+
+
+def pack(etag, last_modified, body):
+    '''Cache entry holding the validators in front of the serialized body.'''
+    return f'{etag}\n{last_modified}\n'.encode() + body
+
+
+def unpack(entry):
+    etag, last_modified, body = entry.split(b'\n', 2)
+    return etag.decode(), last_modified.decode(), body
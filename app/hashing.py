@@ -0,0 +1,252 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from werkzeug.security import generate_password_hash, check_password_hash
+from .metrics import HASH_SECONDS, current_endpoint
+
+logger = logging.getLogger(__name__)
+
+
+class HashingBusy(Exception):
+    '''Raised when the hashing queue is full and the request should be shed.'''
+
+    def __init__(self, retry_after):
+        super().__init__("Password hashing queue is full.")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    '''Runs password hashing in a bounded process pool.
+
+    HASH_POOL_WORKERS=0 keeps hashing inline on the request thread, which is
+    what the dev server and one-off scripts want.
+    '''
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._background = None
+        self._pending_rehash = set()
+        self._canonical_method = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.method = 'pbkdf2:sha256'
+        self.workers = 0
+        self.queue_size = 0
+        self.acquire_timeout = 0.0
+        self.retry_after = 1
+        self.rejected = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config.get('HASH_METHOD', self.method)
+        self._canonical_method = None
+        self.workers = app.config.get('HASH_POOL_WORKERS', 0)
+        self.queue_size = app.config.get('HASH_QUEUE_SIZE', self.workers * 4)
+        self.acquire_timeout = app.config.get('HASH_QUEUE_TIMEOUT', 0.05)
+        self.retry_after = app.config.get('HASH_RETRY_AFTER', 1)
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size) if self.workers else None
+        app.extensions['password_hasher'] = self
+        app.cli.add_command(hashing_cli)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _discard(self, executor):
+        '''Drop a pool that a dead worker broke, so the next call starts a new one.'''
+        with self._lock:
+            if self._executor is executor:
+                logger.warning("Password hashing pool broken by a dead worker; starting a new one")
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def warm(self):
+        '''Start every pool worker and resolve the hashing method ahead of traffic.'''
+        self.canonical_method
+        if self.workers:
+            futures = [self.executor.submit(generate_password_hash, '', self.method) for _ in range(self.workers)]
+            for future in futures:
+                future.result()
+
+    def hash(self, password):
+        with self._slot('hash'):
+            return self._call(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        with self._slot('verify'):
+            return self._call(check_password_hash, password_hash, password)
+
+    def hash_many(self, passwords):
+        '''Hash a batch across the pool workers.
+
+        Every password is its own task holding its own queue slot, and at most
+        one per worker is in flight, so a login admitted during a bulk import
+        waits behind at most one hash per worker, and is shed with HashingBusy
+        like any other request when the queue is full.
+        '''
+        if not self.workers:
+            with self._slot('hash_many'):
+                return [generate_password_hash(password, self.method) for password in passwords]
+        with HASH_SECONDS.time(endpoint=current_endpoint(), op='hash_many'):
+            window = threading.BoundedSemaphore(self.workers)
+            executor = self.executor
+            futures = []
+
+            def done(future):
+                self._slots.release()
+                window.release()
+
+            try:
+                for password in passwords:
+                    window.acquire()
+                    try:
+                        self._acquire()
+                    except HashingBusy:
+                        window.release()
+                        raise
+                    try:
+                        future = executor.submit(generate_password_hash, password, self.method)
+                    except BrokenProcessPool:
+                        done(None)
+                        raise
+                    future.add_done_callback(done)
+                    futures.append(future)
+                return [future.result() for future in futures]
+            except (HashingBusy, BrokenProcessPool) as e:
+                for future in futures:
+                    future.cancel()
+                if isinstance(e, BrokenProcessPool):
+                    self._discard(executor)
+                    raise HashingBusy(self.retry_after) from e
+                raise
+
+    def _call(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        # A worker killed by the OOM killer or a crash breaks the whole pool;
+        # replace it and retry once.
+        for _ in range(2):
+            executor = self.executor
+            try:
+                return executor.submit(fn, *args).result()
+            except BrokenProcessPool:
+                self._discard(executor)
+        raise HashingBusy(self.retry_after)
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusy(self.retry_after)
+
+    @contextmanager
+    def _slot(self, op):
+        with HASH_SECONDS.time(endpoint=current_endpoint(), op=op):
+            if self.workers:
+                self._acquire()
+            try:
+                yield
+            finally:
+                if self.workers:
+                    self._slots.release()
+
+    @property
+    def canonical_method(self):
+        '''The method prefix werkzeug writes for HASH_METHOD, defaults filled in.'''
+        if self._canonical_method is None:
+            self._canonical_method = generate_password_hash('', self.method).split('$', 1)[0]
+        return self._canonical_method
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.canonical_method
+
+    def rehash_in_background(self, user, password):
+        '''Re-hash a verified password with the current policy after the response.
+
+        The update only applies if the stored hash is unchanged, so a password
+        reset racing with the login always wins.
+        '''
+        with self._lock:
+            if user.id in self._pending_rehash:
+                return
+            self._pending_rehash.add(user.id)
+            if self._background is None:
+                self._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rehash')
+        self._background.submit(self._rehash, current_app._get_current_object(),
+                                user.id, user.password_hash, password)
+
+    def _rehash(self, app, user_id, old_hash, password):
+        from .models import User
+        from . import db
+        try:
+            new_hash = self.hash(password)
+            with app.app_context():
+                User.query.filter_by(id=user_id, password_hash=old_hash).update(
+                    {'password_hash': new_hash, 'updated_at': User.updated_at},
+                    synchronize_session=False
+                )
+                db.session.commit()
+        except HashingBusy:
+            pass
+        except Exception:
+            logger.exception("Background rehash failed for user %s", user_id)
+        finally:
+            with self._lock:
+                self._pending_rehash.discard(user_id)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._background is not None:
+            self._background.shutdown(wait=False)
+            self._background = None
+
+
+def _time_hash(method, rounds=3):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        generate_password_hash('calibration-password', method)
+    return (time.perf_counter() - start) / rounds
+
+
+def calibrate(target_ms, algorithm='pbkdf2:sha256'):
+    '''Pick the hashing cost whose verify time on this host is closest to target_ms.'''
+    target = target_ms / 1000.0
+    if algorithm.startswith('scrypt'):
+        n = 2 ** 12
+        elapsed = _time_hash(f'scrypt:{n}:8:1')
+        while elapsed * 2 <= target and n < 2 ** 20:
+            n *= 2
+            elapsed = _time_hash(f'scrypt:{n}:8:1')
+        return f'scrypt:{n}:8:1', elapsed
+    probe = 100000
+    elapsed = _time_hash(f'{algorithm}:{probe}')
+    iterations = max(10000, int(probe * target / elapsed) // 1000 * 1000)
+    method = f'{algorithm}:{iterations}'
+    return method, _time_hash(method)
+
+
+hashing_cli = AppGroup('hashing', help='Password hashing policy commands.')
+
+
+@hashing_cli.command('calibrate')
+@click.option('--target-ms', default=50.0, show_default=True, help='Target verify time per password.')
+@click.option('--algorithm', default='pbkdf2:sha256', show_default=True,
+              help='pbkdf2:<digest> or scrypt.')
+def calibrate_command(target_ms, algorithm):
+    '''Benchmark this host and print a HASH_METHOD for the target cost.'''
+    method, elapsed = calibrate(target_ms, algorithm)
+    click.echo(f'Measured {elapsed * 1000:.1f} ms per hash.')
+    click.echo(f'HASH_METHOD={method}')
@@ -0,0 +1,139 @@
+import logging
+import smtplib
+import threading
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from flask_mail import Message
+
+logger = logging.getLogger(__name__)
+
+
+class MailQueue:
+    '''Durable outbound mail queue.
+
+    Messages are written to the outbox_message table in the caller's
+    transaction and delivered by a background thread that reuses one SMTP
+    connection per batch. Failed sends are retried with exponential backoff
+    until MAIL_QUEUE_MAX_ATTEMPTS, then marked failed.
+    '''
+
+    def __init__(self, app=None):
+        self.app = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = app.config.get('MAIL_QUEUE_BATCH_SIZE', 50)
+        self.max_attempts = app.config.get('MAIL_QUEUE_MAX_ATTEMPTS', 5)
+        self.backoff = app.config.get('MAIL_QUEUE_BACKOFF', 30)
+        self.poll_interval = app.config.get('MAIL_QUEUE_POLL_INTERVAL', 10)
+        self.worker_enabled = app.config.get('MAIL_QUEUE_WORKER', True)
+        app.extensions['mail_queue'] = self
+        app.cli.add_command(mail_cli)
+        # Picks up whatever was left in the outbox by a previous process.
+        app.before_request(self.start)
+
+    def enqueue(self, msg):
+        '''Store a flask_mail Message for delivery and commit the session.'''
+        from .models import OutboxMessage
+        from . import db
+        for recipient in msg.recipients:
+            db.session.add(OutboxMessage(
+                sender=msg.sender,
+                recipient=recipient,
+                subject=msg.subject,
+                body=msg.body
+            ))
+        db.session.commit()
+        self.start()
+        self._wakeup.set()
+
+    def start(self):
+        if not self.worker_enabled or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='mail-queue', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    while self.deliver_due() == self.batch_size:
+                        pass
+            except Exception:
+                logger.exception("Mail queue delivery failed")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def deliver_due(self):
+        '''Send one batch of due messages. Returns how many were claimed.'''
+        from .models import OutboxMessage
+        from . import db, mail
+        now = datetime.utcnow()
+        batch = OutboxMessage.query.filter(
+            OutboxMessage.status == 'pending',
+            OutboxMessage.next_attempt_at <= now
+        ).order_by(OutboxMessage.next_attempt_at).limit(self.batch_size).with_for_update(skip_locked=True).all()
+        if not batch:
+            db.session.rollback()
+            return 0
+
+        if 'mail' not in self.app.extensions:
+            mail.init_app(self.app)
+        unsent = list(batch)
+        try:
+            with mail.connect() as connection:
+                while unsent:
+                    message = unsent[0]
+                    try:
+                        connection.send(Message(message.subject, sender=message.sender,
+                                                recipients=[message.recipient], body=message.body))
+                        message.status = 'sent'
+                        message.sent_at = datetime.utcnow()
+                    except smtplib.SMTPRecipientsRefused as e:
+                        self._retry_later(message, e)
+                    unsent.pop(0)
+        except Exception as e:
+            # The connection is gone; everything not yet sent waits for the next round.
+            for message in unsent:
+                self._retry_later(message, e)
+        db.session.commit()
+        return len(batch)
+
+    def _retry_later(self, message, error):
+        message.attempts += 1
+        message.last_error = str(error)
+        if message.attempts >= self.max_attempts:
+            message.status = 'failed'
+            logger.error("Giving up on outbox message %s to %s: %s", message.id, message.recipient, error)
+        else:
+            delay = min(self.backoff * 2 ** (message.attempts - 1), 3600)
+            message.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+
+mail_cli = AppGroup('mail', help='Outbound mail queue commands.')
+
+
+@mail_cli.command('flush')
+def flush_command():
+    '''Deliver every due message in the outbox, then exit.'''
+    from . import mail_queue
+    total = 0
+    while True:
+        claimed = mail_queue.deliver_due()
+        total += claimed
+        if claimed < mail_queue.batch_size:
+            break
+    click.echo(f'Processed {total} message(s).')
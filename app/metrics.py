@@ -0,0 +1,267 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        labelnames = self.labelnames + ('le',)
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{self.name}_bucket{_format_labels(labelnames, key + (le,))} {cumulative}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        '''Register fn() -> [(name, type, help, [(labels_dict, value), ...]), ...].'''
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for fn in self._collectors:
+            try:
+                families = fn()
+            except Exception:
+                logger.exception("Metrics collector %s failed", fn.__name__)
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(tuple(labels), tuple(labels.values()))} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint.', ('endpoint', 'method'))
+REQUESTS = registry.counter(
+    'http_requests_total', 'Requests by endpoint and status code.', ('endpoint', 'method', 'status'))
+QUERY_SECONDS = registry.histogram(
+    'db_query_duration_seconds', 'SQL statement latency by endpoint.', ('endpoint',),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+QUERIES_PER_REQUEST = registry.histogram(
+    'db_queries_per_request', 'SQL statements issued per request.', ('endpoint',),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50))
+HASH_SECONDS = registry.histogram(
+    'password_hash_duration_seconds', 'Password hashing latency by endpoint and operation.',
+    ('endpoint', 'op'), buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+
+@registry.collector
+def extension_metrics():
+    from .pool import pool_stats
+    extensions = current_app.extensions
+    families = []
+    if 'cache' in extensions:
+        stats = extensions['cache'].metrics()
+        families.append(('cache_hits_total', 'counter', 'Profile cache hits.', [({}, stats['hits'])]))
+        families.append(('cache_misses_total', 'counter', 'Profile cache misses.', [({}, stats['misses'])]))
+        if 'entries' in stats:
+            families.append(('cache_entries', 'gauge', 'Entries in the in-process cache.', [({}, stats['entries'])]))
+            families.append(('cache_bytes', 'gauge', 'Bytes held by the in-process cache.', [({}, stats['bytes'])]))
+    if 'revocation_store' in extensions:
+        stats = extensions['revocation_store'].metrics()
+        if 'entries' in stats:
+            families.append(('revocation_entries', 'gauge', 'Users with revoked tokens held in process.',
+                             [({}, stats['entries'])]))
+    if 'audit_log' in extensions:
+        families.append(('audit_buffer_events', 'gauge', 'Audit events waiting to be written.',
+                         [({}, extensions['audit_log'].pending())]))
+    if 'password_hasher' in extensions:
+        rejected = extensions['password_hasher'].rejected
+        families.append(('password_hash_rejected_total', 'counter',
+                         'Hashing requests shed because the queue was full.', [({}, rejected)]))
+    pools = {bind: stats for bind, stats in pool_stats().items() if 'checkouts' in stats}
+    for key, name, kind, documentation in (
+        ('size', 'db_pool_size', 'gauge', 'Configured pool size.'),
+        ('checked_out', 'db_pool_checked_out', 'gauge', 'Connections currently in use.'),
+        ('overflow', 'db_pool_overflow', 'gauge', 'Overflow connections beyond the pool size.'),
+        ('checkouts', 'db_pool_checkouts_total', 'counter', 'Connection checkouts.'),
+        ('checkout_wait_total', 'db_pool_checkout_wait_seconds_total', 'counter',
+         'Seconds spent waiting for a connection.'),
+        ('checkout_wait_max', 'db_pool_checkout_wait_max_seconds', 'gauge', 'Longest wait for a connection.'),
+        ('checkout_timeouts', 'db_pool_checkout_timeouts_total', 'counter', 'Checkouts that timed out.'),
+    ):
+        if pools:
+            families.append((name, kind, documentation,
+                             [({'bind': bind}, stats[key]) for bind, stats in pools.items()]))
+    return families
+
+
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or '-'
+    return '-'
+
+
+# Called after every statement as listener(conn, cursor, statement, parameters,
+# executemany, elapsed, endpoint); used by the query profiler and test helpers.
+query_listeners = []
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which goes away with the statement even
+    # when it raises and after_cursor_execute never runs. Statements run
+    # without a context overwrite a single slot on the connection instead.
+    start = time.perf_counter()
+    if context is not None:
+        context.query_start = start
+    else:
+        conn.info['query_start'] = start
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = context.query_start if context is not None else conn.info.pop('query_start')
+    elapsed = time.perf_counter() - start
+    endpoint = current_endpoint()
+    QUERY_SECONDS.observe(elapsed, endpoint=endpoint)
+    if has_request_context() and 'query_count' in g:
+        g.query_count += 1
+        g.query_time += elapsed
+        if g.query_log is not None:
+            g.query_log.append((elapsed, statement))
+    for listener in tuple(query_listeners):
+        listener(conn, cursor, statement, parameters, executemany, elapsed, endpoint)
+
+
+class Metrics:
+    '''Request, SQL and hashing instrumentation served at /metrics.'''
+
+    def __init__(self, app=None):
+        self.slow_request_seconds = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        slow_ms = app.config.get('SLOW_REQUEST_MS')
+        self.slow_request_seconds = slow_ms / 1000.0 if slow_ms else None
+        app.extensions['metrics'] = self
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+
+    def _start_request(self):
+        g.request_start = time.perf_counter()
+        g.query_count = 0
+        g.query_time = 0.0
+        g.query_log = [] if self.slow_request_seconds is not None else None
+
+    def _finish_request(self, response):
+        if 'request_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_start
+        endpoint = request.endpoint or '-'
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method)
+        REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        QUERIES_PER_REQUEST.observe(g.query_count, endpoint=endpoint)
+        if self.slow_request_seconds is not None and elapsed >= self.slow_request_seconds:
+            slowest = sorted(g.query_log, reverse=True)[:5]
+            logger.warning(
+                "Slow request %s %s: %.1f ms, %d queries in %.1f ms%s",
+                request.method, request.path, elapsed * 1000, g.query_count, g.query_time * 1000,
+                ''.join(f'\n  {seconds * 1000:.1f} ms  {" ".join(statement.split())[:200]}'
+                        for seconds, statement in slowest)
+            )
+        return response
+
+    def render(self):
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -1,8 +1,7 @@
 from sqlalchemy.orm import validates
 from datetime import datetime
 from enum import Enum
-from app import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from app import db, hasher
 
 class UserRole(Enum):
     USER = 'USER'
@@ -10,23 +9,86 @@ class UserRole(Enum):
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(50), nullable=False, unique=True)
+    username = db.Column(db.String(50), nullable=False)
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
-    email = db.Column(db.String(100), nullable=False, unique=True)
+    email = db.Column(db.String(100), nullable=False)
     role = db.Column(db.Enum(UserRole), default=UserRole.USER)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     active = db.Column(db.Boolean, default=True)
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Set by DELETE; the row is purged in the background later.
+    deleted_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_user_created_at_id', 'created_at', 'id'),
+        db.Index('ix_user_role_active_created_at', 'role', 'active', 'created_at', 'id'),
+        db.Index('ix_user_username_prefix', 'username', postgresql_ops={'username': 'text_pattern_ops'}),
+        db.Index('ix_user_email_prefix', 'email', postgresql_ops={'email': 'text_pattern_ops'}),
+        # Unique among live users only, so a deleted user's username and email
+        # can be taken again. Lookups must filter on deleted_at IS NULL to use them.
+        db.Index('uq_user_username_live', 'username', unique=True,
+                 postgresql_where=deleted_at.is_(None), sqlite_where=deleted_at.is_(None)),
+        db.Index('uq_user_email_live', 'email', unique=True,
+                 postgresql_where=deleted_at.is_(None), sqlite_where=deleted_at.is_(None)),
+        db.Index('ix_user_deleted_at', 'deleted_at',
+                 postgresql_where=deleted_at.isnot(None), sqlite_where=deleted_at.isnot(None)),
+    )
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+
+    def needs_rehash(self):
+        return hasher.needs_rehash(self.password_hash)
+
+    def revoke_tokens(self):
+        '''Invalidate every token issued so far. Returns the new version.'''
+        self.token_version = (self.token_version or 0) + 1
+        return self.token_version
+
+    def soft_delete(self):
+        '''Mark deleted and revoke every token. Returns the new token version.'''
+        self.deleted_at = datetime.utcnow()
+        return self.revoke_tokens()
     
     @validates('email')
     def validate_email(self, key, address):
         assert '@' in address
         return address
+
+class OutboxMessage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sender = db.Column(db.String(100), nullable=False)
+    recipient = db.Column(db.String(100), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_outbox_message_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+class AuditEvent(db.Model):
+    # On Postgres the migration creates this table partitioned by month on
+    # created_at, with (id, created_at) as the primary key.
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    user_id = db.Column(db.Integer)
+    actor_id = db.Column(db.Integer)
+    action = db.Column(db.String(32), nullable=False)
+    ip = db.Column(db.String(45))
+    details = db.Column(db.JSON)
+
+    __table_args__ = (
+        db.Index('ix_audit_event_user_id_created_at', 'user_id', 'created_at'),
+    )
@@ -0,0 +1,118 @@
+import threading
+import time
+from flask import g
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    '''QueuePool that records how long each checkout waited for a connection.'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self.stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self.stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.checkouts, pool.wait_total, pool.wait_max, pool.timeouts = (
+            self.checkouts, self.wait_total, self.wait_max, self.timeouts
+        )
+        return pool
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                'size': self.size(),
+                'checked_out': self.checkedout(),
+                'overflow': self.overflow(),
+                'checkouts': self.checkouts,
+                'checkout_wait_total': self.wait_total,
+                'checkout_wait_max': self.wait_max,
+                'checkout_timeouts': self.timeouts,
+            }
+
+
+def engine_options(app, uri, options=None):
+    '''Build engine options for uri from the DB_* settings.'''
+    url = make_url(uri)
+    options = dict(options or {})
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return options
+    options.setdefault('poolclass', TimedQueuePool)
+    options.setdefault('pool_size', app.config.get('DB_POOL_SIZE', 10))
+    options.setdefault('max_overflow', app.config.get('DB_MAX_OVERFLOW', 5))
+    options.setdefault('pool_timeout', app.config.get('DB_POOL_TIMEOUT', 5))
+    options.setdefault('pool_recycle', app.config.get('DB_POOL_RECYCLE', 1800))
+    options.setdefault('pool_pre_ping', app.config.get('DB_POOL_PRE_PING', True))
+    timeout = app.config.get('DB_STATEMENT_TIMEOUT_MS')
+    if timeout and url.get_backend_name() == 'postgresql':
+        connect_args = dict(options.get('connect_args') or {})
+        connect_args.setdefault('options', f'-c statement_timeout={int(timeout)}')
+        options['connect_args'] = connect_args
+    return options
+
+
+def init_app(app):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+        app, app.config['SQLALCHEMY_DATABASE_URI'], app.config.get('SQLALCHEMY_ENGINE_OPTIONS')
+    )
+    binds = {}
+    for key, bind in (app.config.get('SQLALCHEMY_BINDS') or {}).items():
+        if isinstance(bind, str):
+            bind = {'url': bind}
+        binds[key] = {**engine_options(app, bind['url'], bind), 'url': bind['url']}
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+    @app.teardown_appcontext
+    def close_read_session(exc):
+        session = g.pop('read_session', None)
+        if session is not None:
+            session.close()
+
+
+def read_session():
+    '''Session on the read replica if one is configured, otherwise db.session.
+
+    Replicas lag, so only use this for reads whose result is not cached or
+    written back.
+    '''
+    from . import db
+    engine = db.engines.get('replica')
+    if engine is None:
+        return db.session
+    if 'read_session' not in g:
+        g.read_session = Session(engine)
+    return g.read_session
+
+
+def pool_stats():
+    from . import db
+    stats = {}
+    for key, engine in db.engines.items():
+        pool = engine.pool
+        name = key or 'primary'
+        if isinstance(pool, TimedQueuePool):
+            stats[name] = pool.stats()
+        else:
+            stats[name] = {'status': pool.status()}
+    return stats
@@ -0,0 +1,142 @@
+import json
+import logging
+import threading
+from collections import Counter, deque
+from flask import g, has_request_context, jsonify, request
+from flask_jwt_extended import get_jwt_identity, jwt_required
+from .metrics import query_listeners
+
+logger = logging.getLogger(__name__)
+
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE')
+
+
+def _seq_scans(plan):
+    '''Relations read with a sequential scan anywhere in a Postgres JSON plan.'''
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', ()):
+        found.extend(_seq_scans(child))
+    return found
+
+
+def explain_seq_scans(dialect, cursor, statement, parameters):
+    '''Tables the planner would scan in full for statement, or None if unknown.
+
+    Runs EXPLAIN on the raw DBAPI cursor, so it is not itself profiled. On
+    Postgres it runs inside a savepoint, so a failed EXPLAIN does not abort
+    the transaction the profiled statement belongs to.
+    '''
+    if dialect == 'postgresql':
+        cursor.execute('SAVEPOINT query_explain')
+        try:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+            plan = cursor.fetchone()[0]
+        except Exception:
+            cursor.execute('ROLLBACK TO SAVEPOINT query_explain')
+            raise
+        finally:
+            cursor.execute('RELEASE SAVEPOINT query_explain')
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return _seq_scans(plan[0]['Plan'])
+    if dialect == 'sqlite':
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        # Rows read "SCAN user" for a full scan, "SEARCH user USING INDEX ..." otherwise.
+        details = [row[-1].split() for row in cursor.fetchall()]
+        return [words[1] for words in details if len(words) == 2 and words[0] == 'SCAN']
+    return None
+
+
+class QueryProfiler:
+    '''Records every SQL statement with its timing, parameters and route.
+
+    With QUERY_PROFILING on, the last QUERY_PROFILE_SIZE statements are kept
+    and served to ADMIN users at /debug/queries. Requests that run the same statement
+    QUERY_REPEAT_THRESHOLD times or more are logged as likely N+1 patterns,
+    and with QUERY_EXPLAIN each distinct statement is EXPLAINed once and
+    logged if it falls back to a sequential scan. Parameters are recorded
+    verbatim, so keep this out of production.
+    '''
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.explain = False
+        self.repeat_threshold = 5
+        self._records = deque(maxlen=1000)
+        self._plans = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('QUERY_PROFILING', False)
+        self.explain = app.config.get('QUERY_EXPLAIN', False)
+        self.repeat_threshold = app.config.get('QUERY_REPEAT_THRESHOLD', 5)
+        self._records = deque(maxlen=app.config.get('QUERY_PROFILE_SIZE', 1000))
+        app.extensions['query_profiler'] = self
+        if not self.enabled:
+            return
+        if self._record not in query_listeners:
+            query_listeners.append(self._record)
+        app.after_request(self._check_request)
+        app.add_url_rule('/debug/queries', 'debug_queries', self.render)
+
+    def _record(self, conn, cursor, statement, parameters, executemany, elapsed, endpoint):
+        record = {
+            'statement': statement,
+            'parameters': repr(parameters)[:500],
+            'ms': round(elapsed * 1000, 3),
+            'endpoint': endpoint,
+            'route': f'{request.method} {request.path}' if has_request_context() else None,
+        }
+        if self.explain and not executemany and statement.lstrip()[:6].upper() in EXPLAINABLE:
+            record['seq_scans'] = self._seq_scans(conn, statement, parameters)
+        with self._lock:
+            self._records.append(record)
+        if has_request_context():
+            g.setdefault('profiled_queries', []).append(record)
+
+    def _seq_scans(self, conn, statement, parameters):
+        if statement in self._plans:
+            return self._plans[statement]
+        try:
+            cursor = conn.connection.cursor()
+            try:
+                tables = explain_seq_scans(conn.dialect.name, cursor, statement, parameters)
+            finally:
+                cursor.close()
+        except Exception:
+            logger.debug("EXPLAIN failed for %s", statement, exc_info=True)
+            tables = None
+        if tables:
+            logger.warning("Sequential scan on %s: %s", ', '.join(tables), ' '.join(statement.split())[:300])
+        if len(self._plans) < 10000:
+            self._plans[statement] = tables
+        return tables
+
+    def _check_request(self, response):
+        records = g.get('profiled_queries')
+        if records:
+            repeated = Counter(record['statement'] for record in records)
+            for statement, count in repeated.items():
+                if count >= self.repeat_threshold:
+                    logger.warning("Possible N+1 in %s %s: statement ran %d times: %s",
+                                   request.method, request.path, count, ' '.join(statement.split())[:300])
+        return response
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    @jwt_required()
+    def render(self):
+        if get_jwt_identity()['role'] != 'ADMIN':
+            return jsonify({'msg': "Permission denied. Only ADMIN can access."}), 403
+        return jsonify({'queries': self.records()})
+
@@ -0,0 +1,97 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+USERS_PURGED = registry.counter('users_purged_total', 'Soft-deleted users removed for good.')
+
+
+class UserPurge:
+    '''Removes soft-deleted users once USER_PURGE_AFTER_DAYS have passed.
+
+    DELETE only sets deleted_at; a background thread deletes expired rows
+    every USER_PURGE_INTERVAL seconds in batches of USER_PURGE_BATCH_SIZE,
+    each in its own short transaction, so no statement holds many row locks.
+    Keep the retention at least as long as the refresh token lifetime: the
+    soft-deleted row is what lets a restarted node reject old tokens.
+    '''
+
+    def __init__(self, app=None):
+        self.app = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.after = timedelta(days=app.config.get('USER_PURGE_AFTER_DAYS', 30))
+        self.batch_size = app.config.get('USER_PURGE_BATCH_SIZE', 500)
+        self.interval = app.config.get('USER_PURGE_INTERVAL', 3600)
+        self.worker_enabled = app.config.get('USER_PURGE_WORKER', True)
+        app.extensions['user_purge'] = self
+        app.cli.add_command(users_cli)
+        app.before_request(self.start)
+
+    def start(self):
+        if not self.worker_enabled or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='user-purge', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    while self.purge_batch() == self.batch_size and not self._stopping.is_set():
+                        pass
+            except Exception:
+                logger.exception("User purge failed")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def purge_batch(self):
+        '''Delete one batch of expired soft-deleted users. Returns how many.'''
+        from . import db, audit
+        from .models import User
+        cutoff = datetime.utcnow() - self.after
+        ids = db.session.scalars(
+            db.select(User.id).where(User.deleted_at < cutoff)
+            .order_by(User.id).limit(self.batch_size).with_for_update(skip_locked=True)
+        ).all()
+        if not ids:
+            db.session.rollback()
+            return 0
+        db.session.execute(db.delete(User).where(User.id.in_(ids)))
+        db.session.commit()
+        USERS_PURGED.inc(len(ids))
+        audit.record_many('user_purged', ids)
+        return len(ids)
+
+
+users_cli = AppGroup('users', help='User maintenance commands.')
+
+
+@users_cli.command('purge')
+def purge_command():
+    '''Remove every expired soft-deleted user, then exit.'''
+    from . import user_purge
+    total = 0
+    while True:
+        purged = user_purge.purge_batch()
+        total += purged
+        if purged < user_purge.batch_size:
+            break
+    click.echo(f'Purged {total} user(s).')
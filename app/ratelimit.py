@@ -0,0 +1,132 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request
+from .metrics import registry
+
+RATELIMIT_DECISIONS = registry.counter(
+    'ratelimit_decisions_total', 'Rate limiter decisions by scope, key type and outcome.',
+    ('scope', 'key', 'outcome'))
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_limit(limit):
+    '''Parse '5/minute' into (5, 60).'''
+    count, _, period = limit.partition('/')
+    return int(count), PERIODS[period.strip().rstrip('s')]
+
+
+class MemoryBackend:
+    '''Sliding-window counters kept in process memory.
+
+    Each key holds the counts of the current and previous fixed windows; the
+    sliding count weights the previous window by how much of it still
+    overlaps. That is two integers per key, whatever the request rate.
+    Keys are kept in least-recently-hit order and the oldest is evicted past
+    max_keys, so a flood of distinct keys costs O(1) per hit and bounded memory.
+    '''
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, window, now):
+        index = int(now // window)
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or state[0] < index - 1:
+                state = [index, 0, 0]
+            elif state[0] == index - 1:
+                state = [index, state[2], 0]
+            state[2] += 1
+            self._windows[key] = state
+            self._windows.move_to_end(key)
+            if len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+            return state[1], state[2]
+
+
+class RedisBackend:
+    '''Sliding-window counters shared through a Redis-protocol server.'''
+
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+
+    def hit(self, key, window, now):
+        index = int(now // window)
+        current = f'{self.prefix}{key}:{index}'
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(f'{self.prefix}{key}:{index - 1}')
+        pipe.incr(current)
+        pipe.expire(current, window * 2)
+        previous, count, _ = pipe.execute()
+        return int(previous or 0), count
+
+
+class RateLimiter:
+    '''Sliding-window limits per client IP and per submitted username.
+
+    Limits come from RATELIMIT_<SCOPE>_PER_IP and RATELIMIT_<SCOPE>_PER_USERNAME,
+    e.g. RATELIMIT_LOGIN_PER_USERNAME = '5/minute'. The check runs before the
+    handler, so rejected requests never reach the database or the hasher.
+    '''
+
+    def __init__(self, app=None):
+        self.backend = MemoryBackend()
+        self.config = {}
+        self.enabled = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATELIMIT_ENABLED', True)
+        if app.config.get('RATELIMIT_BACKEND', 'memory') == 'redis':
+            from . import shared
+            self.backend = RedisBackend(shared.redis_client(app.config.get('RATELIMIT_REDIS_URL')))
+        else:
+            self.backend = MemoryBackend(app.config.get('RATELIMIT_MAX_KEYS', 100000))
+        self.config = app.config
+        app.extensions['rate_limiter'] = self
+
+    def check(self, scope, key_type, key, limit):
+        '''Count a hit for key and return seconds to wait, or 0 if allowed.'''
+        count, window = parse_limit(limit)
+        now = time.time()
+        previous, current = self.backend.hit(f'{scope}:{key_type}:{key}', window, now)
+        overlap = 1 - (now % window) / window
+        if previous * overlap + current <= count:
+            RATELIMIT_DECISIONS.inc(scope=scope, key=key_type, outcome='allowed')
+            return 0
+        RATELIMIT_DECISIONS.inc(scope=scope, key=key_type, outcome='rejected')
+        return max(1, math.ceil(window - now % window))
+
+    def limit(self, scope):
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if self.enabled:
+                    retry_after = self._check_request(scope)
+                    if retry_after:
+                        return {'msg': "Too many requests, please retry later."}, 429, {'Retry-After': str(retry_after)}
+                return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _check_request(self, scope):
+        prefix = f'RATELIMIT_{scope.upper()}'
+        retry_after = 0
+        ip_limit = self.config.get(f'{prefix}_PER_IP')
+        if ip_limit:
+            retry_after = self.check(scope, 'ip', request.remote_addr, ip_limit)
+        username_limit = self.config.get(f'{prefix}_PER_USERNAME')
+        if username_limit and not retry_after:
+            data = request.get_json(silent=True)
+            username = data.get('username') if isinstance(data, dict) else None
+            if isinstance(username, str) and username:
+                retry_after = self.check(scope, 'username', username.lower(), username_limit)
+        return retry_after
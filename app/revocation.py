@@ -0,0 +1,163 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+def _seconds(expires, default):
+    if isinstance(expires, timedelta):
+        return expires.total_seconds()
+    return expires or default
+
+
+class MemoryBackend:
+    '''Per-user minimum token version, kept in process memory.
+
+    Only users revoked within the last `ttl` seconds have an entry: older
+    revocations can only cancel tokens that have expired anyway. Memory is
+    therefore bounded by the revocation rate, not by the number of users.
+    '''
+
+    def __init__(self):
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._sweep_at = 1024
+
+    def get(self, user_id):
+        entry = self._versions.get(user_id)
+        return entry[0] if entry is not None and entry[1] > time.monotonic() else 0
+
+    def set_many(self, versions, ttl):
+        now = time.monotonic()
+        with self._lock:
+            for user_id, version in versions:
+                entry = self._versions.get(user_id)
+                if entry is None or entry[0] < version:
+                    self._versions[user_id] = (version, now + ttl)
+            if len(self._versions) >= self._sweep_at:
+                self._versions = {k: entry for k, entry in self._versions.items() if entry[1] > now}
+                self._sweep_at = max(1024, len(self._versions) * 2)
+
+    def info(self):
+        return {'entries': len(self._versions)}
+
+
+class RedisBackend:
+    '''Per-user minimum token version shared through a Redis-protocol server.'''
+
+    def __init__(self, client, prefix='revoked:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, user_id):
+        return int(self.client.get(f'{self.prefix}{user_id}') or 0)
+
+    def set_many(self, versions, ttl):
+        pipe = self.client.pipeline(transaction=False)
+        for user_id, version in versions:
+            pipe.set(f'{self.prefix}{user_id}', version, ex=int(ttl) or None)
+        pipe.execute()
+
+    def info(self):
+        return {}
+
+
+class RevocationStore:
+    '''Rejects tokens issued before a user's last revocation.
+
+    Every token carries the user's `token_version` in its 'ver' claim.
+    Revoking bumps the column in the same transaction as the change that
+    caused it, then records the new version here; the blocklist hook rejects
+    any token whose 'ver' is lower. That is one dict or Redis lookup per
+    request and no database access. With the memory backend, revocations
+    are also published through the shared state so every node applies them.
+    '''
+
+    def __init__(self, app=None):
+        self.backend = MemoryBackend()
+        self.ttl = 900
+        self.identity_claim = 'sub'
+        self._app = None
+        self._warmed = False
+        self._warm_lock = threading.Lock()
+        self.local = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        access = _seconds(app.config.get('JWT_ACCESS_TOKEN_EXPIRES', timedelta(minutes=15)), 0)
+        refresh = _seconds(app.config.get('JWT_REFRESH_TOKEN_EXPIRES', timedelta(days=30)), 0)
+        self.ttl = max(access, refresh)
+        self.identity_claim = app.config.get('JWT_IDENTITY_CLAIM', 'sub')
+        from . import jwt, shared
+        if app.config.get('REVOCATION_BACKEND', 'memory') == 'redis':
+            self.backend = RedisBackend(shared.redis_client(app.config.get('REVOCATION_REDIS_URL')))
+            self._warmed = True
+            self.local = False
+        else:
+            self.backend = MemoryBackend()
+            self._warmed = False
+            self.local = True
+            shared.subscribe('revocations', self._receive)
+        self._app = app
+        app.extensions['revocation_store'] = self
+
+        @jwt.token_in_blocklist_loader
+        def token_revoked(jwt_header, jwt_payload):
+            return self.is_revoked(jwt_payload)
+
+    def revoke(self, user_id, version):
+        '''Reject tokens of user_id with a 'ver' claim below version.'''
+        self.revoke_many([(user_id, version)])
+
+    def revoke_many(self, versions):
+        '''revoke() for an iterable of (user_id, version) pairs.'''
+        versions = list(versions)
+        if versions:
+            self.backend.set_many(versions, self.ttl)
+            if self.local:
+                from . import shared
+                shared.publish('revocations', versions)
+
+    def _receive(self, versions):
+        if versions is None:
+            # Revocations may have been missed; reload them from the database.
+            self._warmed = False
+        else:
+            self.backend.set_many([tuple(pair) for pair in versions], self.ttl)
+
+    def is_revoked(self, jwt_payload):
+        identity = jwt_payload.get(self.identity_claim)
+        if not isinstance(identity, dict):
+            return False
+        if not self._warmed:
+            self.warm()
+        return jwt_payload.get('ver', 0) < self.backend.get(identity.get('id'))
+
+    def warm(self):
+        '''Reload recent revocations from the database after a restart.
+
+        Every revocation also touches updated_at, so users updated within the
+        token lifetime are a superset of those with live revocations. That
+        includes soft-deleted users, whose rows outlive their tokens.
+        '''
+        with self._warm_lock:
+            if self._warmed:
+                return True
+            from . import db
+            from .models import User
+            cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+            try:
+                with self._app.app_context():
+                    rows = db.session.execute(
+                        db.select(User.id, User.token_version)
+                        .where(User.token_version > 0, User.updated_at >= cutoff)
+                    ).all()
+            except Exception:
+                self._app.logger.exception("Could not load revocations; retrying on the next request")
+                return False
+            self.backend.set_many([(row.id, row.token_version) for row in rows], self.ttl)
+            self._warmed = True
+            return True
+
+    def metrics(self):
+        return self.backend.info()
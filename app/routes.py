@@ -1,10 +1,183 @@
-from flask_restx import Namespace, Resource, fields
-from flask import request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from .models import User, UserRole
-from . import db
-from .utils import send_password_reset_email, verify_reset_token, generate_reset_token
-from sqlalchemy.exc import IntegrityError
+import base64
+import json
+from datetime import datetime, timezone
+from flask_restx import Namespace, Resource, fields, inputs, reqparse
+from flask import current_app, request, jsonify, stream_with_context
+from flask_jwt_extended import get_jwt, jwt_required, get_jwt_identity
+from .models import AuditEvent, User, UserRole
+from . import db, audit, hasher, revocations, cache, limiter, serializer
+from .cache import profile_key
+from .conditional import not_modified, pack, precondition_failed, unpack, validators
+from .pool import read_session
+from .utils import send_password_reset_email, verify_reset_token, generate_reset_token, claim_reset_token, create_tokens
+from .hashing import HashingBusy
+from sqlalchemy import insert, or_, select, tuple_, update
+from sqlalchemy.exc import DataError, IntegrityError
+
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(created_at, user_id):
+    raw = json.dumps([created_at.isoformat(), user_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor):
+    created_at, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return datetime.fromisoformat(created_at), int(user_id)
+
+def naive_utc(value):
+    '''Timestamps are stored as naive UTC.'''
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
+
+def user_filters(role=None, active=None, prefix=None):
+    clauses = []
+    if role:
+        clauses.append(User.role == UserRole[role])
+    if active is not None:
+        clauses.append(User.active == active)
+    if prefix:
+        clauses.append(or_(
+            User.username.startswith(prefix, autoescape=True),
+            User.email.startswith(prefix, autoescape=True)
+        ))
+    return clauses
+
+def batch_target(data):
+    '''WHERE clauses for a batch request body, or an error message.'''
+    if not isinstance(data, dict):
+        return None, "Request body must be JSON."
+    ids, filters = data.get('ids'), data.get('filter')
+    if ids is not None:
+        if not isinstance(ids, list) or not ids or not all(type(i) is int for i in ids):
+            return None, "'ids' must be a non-empty list of integers."
+        return [User.id.in_(ids)], None
+    if isinstance(filters, dict) and filters:
+        unknown = set(filters) - {'role', 'active', 'prefix'}
+        if unknown:
+            return None, f"Unknown filter: {', '.join(sorted(unknown))}."
+        role, active, prefix = filters.get('role'), filters.get('active'), filters.get('prefix')
+        if role is not None and role not in UserRole.__members__:
+            return None, "Invalid role."
+        if active is not None and not isinstance(active, bool):
+            return None, "'active' must be a boolean."
+        if prefix is not None and (not isinstance(prefix, str) or not prefix):
+            return None, "'prefix' must be a non-empty string."
+        return user_filters(role, active, prefix), None
+    return None, "Provide 'ids' or a non-empty 'filter'."
+
+def run_batch(statement):
+    '''Execute a set-based UPDATE/DELETE and return the rows it touched.
+
+    Like RETURNING, updates report the new values and deletes the old ones.
+    '''
+    columns = (User.id, User.username, User.token_version)
+    dialect = db.session.get_bind().dialect
+    returning = dialect.update_returning if statement.is_update else dialect.delete_returning
+    if returning:
+        return db.session.execute(statement.returning(*columns)).all()
+    if statement.is_update:
+        ids = db.session.scalars(select(User.id).where(statement.whereclause)).all()
+        db.session.execute(statement)
+        return db.session.execute(select(*columns).where(User.id.in_(ids))).all()
+    rows = db.session.execute(select(*columns).where(statement.whereclause)).all()
+    db.session.execute(statement)
+    return rows
+
+BATCH_UPDATABLE = {'first_name', 'last_name', 'active', 'role'}
+
+BULK_FIELDS = ('username', 'first_name', 'last_name', 'email', 'password')
+
+def ndjson(obj):
+    return json.dumps(obj) + '\n'
+
+def reserved_username(username):
+    '''Whether username names a static route under /user/, e.g. 'export'.
+
+    GET/PUT/DELETE /user/<username> would never reach such a user.
+    '''
+    reserved = current_app.extensions.get('reserved_usernames')
+    if reserved is None:
+        reserved = current_app.extensions['reserved_usernames'] = frozenset(
+            rule.rule.split('/')[2] for rule in current_app.url_map.iter_rules()
+            if rule.rule.startswith('/user/') and not rule.arguments
+        ) - {''}
+    return username in reserved
+
+def parse_bulk_row(data):
+    row = {field: data[field] for field in BULK_FIELDS}
+    if not all(isinstance(value, str) and value for value in row.values()):
+        raise ValueError("all fields must be non-empty strings")
+    if reserved_username(row['username']):
+        raise ValueError("this username is reserved")
+    if '@' not in row['email']:
+        raise ValueError("invalid email")
+    for field in BULK_FIELDS:
+        column = User.__table__.columns.get(field)
+        if column is not None and len(row[field]) > column.type.length:
+            raise ValueError(f"'{field}' is longer than {column.type.length} characters")
+    return row
+
+def import_batch(batch, summary):
+    '''Hash and insert one batch, yielding a result line per row.
+
+    The batch is inserted as one multi-row statement. If that hits a unique
+    violation or a value the database rejects, it is retried row by row,
+    each in its own savepoint, so only the offending rows are rejected.
+    '''
+    try:
+        hashes = hasher.hash_many([row['password'] for _, row in batch])
+    except HashingBusy:
+        for line_no, row in batch:
+            summary['error'] += 1
+            yield ndjson({'line': line_no, 'username': row['username'], 'status': 'error',
+                          'msg': "Server is busy, please retry later."})
+        return
+
+    now = datetime.utcnow()
+    values = []
+    for (_, row), password_hash in zip(batch, hashes):
+        values.append({
+            'username': row['username'],
+            'first_name': row['first_name'],
+            'last_name': row['last_name'],
+            'email': row['email'],
+            'password_hash': password_hash,
+            'role': UserRole.USER,
+            'active': True,
+            'created_at': now,
+            'updated_at': now
+        })
+
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(User), values)
+        statuses = ['created'] * len(values)
+    except (IntegrityError, DataError):
+        statuses = []
+        for value in values:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(User), [value])
+                statuses.append('created')
+            except IntegrityError:
+                statuses.append('conflict')
+            except DataError:
+                statuses.append('error')
+    db.session.commit()
+
+    for (line_no, row), status in zip(batch, statuses):
+        summary[status] += 1
+        result = {'line': line_no, 'username': row['username'], 'status': status}
+        if status == 'conflict':
+            result['msg'] = "Username or email already exists."
+        elif status == 'error':
+            result['msg'] = "Invalid row: rejected by the database."
+        yield ndjson(result)
+
+def invalid_payload(errors):
+    return {'errors': errors, 'message': "Input payload validation failed"}, 400
+
+def hashing_busy(e):
+    return {'msg': "Server is busy, please retry later."}, 503, {'Retry-After': str(e.retry_after)}
 
 def register_routes(api):
     user_ns = api.namespace('user', description='User operations')
@@ -49,6 +222,11 @@ def register_routes(api):
             '''Register a new user'''
             try:
                 data = request.json
+                errors = serializer.validate(register_model, data)
+                if errors:
+                    return invalid_payload(errors)
+                if reserved_username(data['username']):
+                    return {'msg': "This username is reserved."}, 400
                 new_user = User(
                     username=data['username'],
                     first_name=data['first_name'],
@@ -63,48 +241,75 @@ def register_routes(api):
             except IntegrityError:
                 db.session.rollback()
                 return {'msg': "Username or email already exists."}, 400
+            except HashingBusy as e:
+                db.session.rollback()
+                return hashing_busy(e)
             except Exception as e:
                 return {'msg': f"An error occurred: {str(e)}"}, 500
 
     @user_ns.route('/login')
     class UserLogin(Resource):
         @user_ns.expect(login_model)
+        @user_ns.response(429, 'Too many attempts')
+        @limiter.limit('login')
         def post(self):
             '''Login and receive an access token'''
             try:
                 data = request.json
-                user = User.query.filter_by(username=data['username']).first()
+                errors = serializer.validate(login_model, data)
+                if errors:
+                    return invalid_payload(errors)
+                user = User.query.filter_by(username=data['username'], deleted_at=None).first()
                 if user and not user.active:
+                    audit.record('login_failed', user.id, reason='inactive')
                     return {'msg': "Your account is deactivated."}, 401
                 if user and user.check_password(data['password']):
-                    access_token = create_access_token(identity={'id': user.id, 'username': user.username, 'role': user.role.name})
-                    return {'msg': "Login successful.", 'access_token': f'Bearer {access_token}'}, 200
+                    if user.needs_rehash():
+                        hasher.rehash_in_background(user, data['password'])
+                    audit.record('login', user.id, user.id)
+                    return {'msg': "Login successful.", **create_tokens(user)}, 200
+                audit.record('login_failed', user.id if user else None, username=data['username'])
                 return {'msg': "Invalid username or password."}, 401
+            except HashingBusy as e:
+                db.session.rollback()
+                return hashing_busy(e)
+            except Exception as e:
+                return {'msg': f"An error occurred: {str(e)}"}, 500
+
+    @user_ns.route('/refresh')
+    class TokenRefresh(Resource):
+        @user_ns.doc(params={'Authorization': {'in': 'header', 'description': 'Required JWT refresh token', 'required': True}})
+        @jwt_required(refresh=True)
+        def post(self):
+            '''Exchange a refresh token for a new access token'''
+            try:
+                claims = get_jwt()
+                user = db.session.get(User, get_jwt_identity()['id'])
+                if (not user or not user.active or user.deleted_at is not None
+                        or user.token_version != claims.get('ver', 0)):
+                    return {'msg': "Token has been revoked"}, 401
+                return {'msg': "Token refreshed.", **create_tokens(user, refresh=False)}, 200
             except Exception as e:
                 return {'msg': f"An error occurred: {str(e)}"}, 500
 
     @user_ns.route('/forget_password')
     class ForgetPassword(Resource):
         @user_ns.expect(reset_password_request_model)
+        @user_ns.response(429, 'Too many attempts')
+        @limiter.limit('forget_password')
         def post(self):
             '''Request a password reset token'''
             try:
                 data = request.json
-                user = User.query.filter_by(username=data['username']).first()
-                if user and not user.active:
-                    return {'msg': "Your account is deactivated."}, 401
-                
-                
-                if user:
-                    
+                user = User.query.filter_by(username=data['username'], deleted_at=None).first()
+                # The token only goes to the mailbox, and the answer is the
+                # same whether or not the account exists.
+                if user and user.active:
                     token = generate_reset_token(user)
-                    print(user)
-                    # send_password_reset_email(user, token)
-                    return ({
-                        'msg': 'Token generate successful',
-                        'Token': token
-                    }), 200
-                return {'msg': 'User with this email not found.'}, 404
+                    user_id = user.id
+                    send_password_reset_email(user, token)
+                    audit.record('password_reset_requested', user_id)
+                return {'msg': "If the account exists, a password reset email has been sent."}, 200
             except Exception as e:
                 return {'msg': f"An error occurred: {str(e)}"}, 500
 
@@ -116,32 +321,324 @@ def register_routes(api):
             try:
                 data = request.json
                 user = verify_reset_token(data['token'])
-                if user:
-                    user.set_password(data['new_password'])
+                # Hash before claiming, so a 503 from a busy hasher leaves the token usable for the retry.
+                password_hash = hasher.hash(data['new_password']) if user else None
+                # The claim only stops replays within this process; the UPDATE only
+                # matches while the old hash is still there, so one reset wins everywhere.
+                if user and claim_reset_token(data['token']):
+                    statement = update(User).where(
+                        User.id == user.id, User.password_hash == user.password_hash, User.deleted_at.is_(None)
+                    ).values(password_hash=password_hash, updated_at=datetime.utcnow(),
+                             token_version=User.token_version + 1)
+                    rows = run_batch(statement)
                     db.session.commit()
-                    return {'msg': 'Password has been reset.'}, 200
+                    if rows:
+                        user_id, username, version = rows[0]
+                        revocations.revoke(user_id, version)
+                        cache.delete(profile_key(username))
+                        audit.record('password_reset', user_id, user_id)
+                        return {'msg': 'Password has been reset.'}, 200
                 return {'msg': 'Invalid or expired token.'}, 400
+            except HashingBusy as e:
+                db.session.rollback()
+                return hashing_busy(e)
             except Exception as e:
                 return {'msg': f"An error occurred: {str(e)}"}, 500
 
+    user_page_model = api.model('UserPage', {
+        'users': fields.List(fields.Nested(user_model)),
+        'next_cursor': fields.String()
+    })
+
+    list_parser = reqparse.RequestParser()
+    list_parser.add_argument('limit', type=int, default=50, location='args')
+    list_parser.add_argument('cursor', type=str, location='args')
+    list_parser.add_argument('role', type=str, choices=[role.name for role in UserRole], location='args')
+    list_parser.add_argument('active', type=inputs.boolean, location='args')
+    list_parser.add_argument('prefix', type=str, location='args', help='Username or email prefix')
+
+    @user_ns.route('/')
+    class UserList(Resource):
+        @user_ns.expect(list_parser)
+        @user_ns.marshal_with(user_page_model)
+        @user_ns.doc(params={'Authorization': {'in': 'header', 'description': 'Required JWT token', 'required': True}})
+        @jwt_required()
+        def get(self):
+            '''List users, ordered by creation time'''
+            current_user = get_jwt_identity()
+            if current_user['role'] != 'ADMIN':
+                api.abort(403, "Permission denied. Only ADMIN can access.")
+
+            args = list_parser.parse_args()
+            limit = min(max(args['limit'], 1), MAX_PAGE_SIZE)
+            query = read_session().query(
+                User.id, User.username, User.first_name, User.last_name,
+                User.email, User.role, User.active, User.created_at
+            )
+            query = query.filter(User.deleted_at.is_(None), *user_filters(args['role'], args['active'], args['prefix']))
+            if args['cursor']:
+                try:
+                    created_at, user_id = decode_cursor(args['cursor'])
+                except (TypeError, ValueError):
+                    api.abort(400, "Invalid cursor.")
+                query = query.filter(tuple_(User.created_at, User.id) > (created_at, user_id))
+
+            rows = query.order_by(User.created_at, User.id).limit(limit + 1).all()
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+            return {'users': rows, 'next_cursor': next_cursor}
+
+    audit_event_model = api.model('AuditEvent', {
+        'id': fields.Integer(),
+        'created_at': fields.DateTime(),
+        'user_id': fields.Integer(),
+        'actor_id': fields.Integer(),
+        'action': fields.String(),
+        'ip': fields.String(),
+        'details': fields.Raw()
+    })
+
+    audit_parser = reqparse.RequestParser()
+    audit_parser.add_argument('user_id', type=int, location='args')
+    audit_parser.add_argument('since', type=inputs.datetime_from_iso8601, location='args')
+    audit_parser.add_argument('until', type=inputs.datetime_from_iso8601, location='args')
+    audit_parser.add_argument('limit', type=int, default=50, location='args')
+
+    # Not under /user/, where it would shadow the profile of a user named 'audit'.
+    audit_ns = api.namespace('audit', description='Audit log')
+
+    @audit_ns.route('/')
+    class AuditTrail(Resource):
+        @audit_ns.expect(audit_parser)
+        @audit_ns.marshal_list_with(audit_event_model)
+        @audit_ns.doc(params={'Authorization': {'in': 'header', 'description': 'Required JWT token', 'required': True}})
+        @jwt_required()
+        def get(self):
+            '''List audit events, newest first'''
+            current_user = get_jwt_identity()
+            if current_user['role'] != 'ADMIN':
+                api.abort(403, "Permission denied. Only ADMIN can access.")
+
+            args = audit_parser.parse_args()
+            query = read_session().query(AuditEvent)
+            if args['user_id'] is not None:
+                query = query.filter(AuditEvent.user_id == args['user_id'])
+            if args['since']:
+                query = query.filter(AuditEvent.created_at >= naive_utc(args['since']))
+            if args['until']:
+                query = query.filter(AuditEvent.created_at < naive_utc(args['until']))
+            limit = min(max(args['limit'], 1), MAX_PAGE_SIZE)
+            return query.order_by(AuditEvent.created_at.desc(), AuditEvent.id.desc()).limit(limit).all()
+
+    @user_ns.route('/bulk')
+    class UserBulkImport(Resource):
+        @user_ns.doc(params={'Authorization': {'in': 'header', 'description': 'Required JWT token', 'required': True}},
+                     description='Body is NDJSON, one RegisterUser object per line. '
+                                 'The response streams one NDJSON result per input line, then a summary line.')
+        @jwt_required()
+        def post(self):
+            '''Import users from an NDJSON stream'''
+            current_user = get_jwt_identity()
+            if current_user['role'] != 'ADMIN':
+                return {'msg': "Permission denied. Only ADMIN can access."}, 403
+
+            batch_size = current_app.config.get('BULK_BATCH_SIZE', 500)
+
+            def generate():
+                summary = {'created': 0, 'conflict': 0, 'error': 0}
+                batch = []
+                for line_no, line in enumerate(request.stream, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        row = parse_bulk_row(json.loads(line))
+                    except (ValueError, TypeError, KeyError) as e:
+                        summary['error'] += 1
+                        yield ndjson({'line': line_no, 'status': 'error', 'msg': f"Invalid row: {e}"})
+                        continue
+                    batch.append((line_no, row))
+                    if len(batch) >= batch_size:
+                        yield from import_batch(batch, summary)
+                        batch = []
+                if batch:
+                    yield from import_batch(batch, summary)
+                yield ndjson({'summary': summary})
+
+            return current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    @user_ns.route('/export')
+    class UserExport(Resource):
+        @user_ns.doc(params={'Authorization': {'in': 'header', 'description': 'Required JWT token', 'required': True}},
+                     description='Streams every user as NDJSON in the User model shape.')
+        @jwt_required()
+        def get(self):
+            '''Export all users as NDJSON'''
+            current_user = get_jwt_identity()
+            if current_user['role'] != 'ADMIN':
+                return {'msg': "Permission denied. Only ADMIN can access."}, 403
+
+            fetch_size = current_app.config.get('EXPORT_FETCH_SIZE', 1000)
+            query = select(
+                User.id, User.username, User.first_name, User.last_name,
+                User.email, User.role, User.active
+            ).where(User.deleted_at.is_(None)).order_by(User.id).execution_options(yield_per=fetch_size)
+
+            def generate():
+                for row in read_session().execute(query):
+                    yield serializer.dump(user_model, row) + b'\n'
+
+            return current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    batch_update_model = api.model('BatchUpdate', {
+        'ids': fields.List(fields.Integer()),
+        'filter': fields.Raw(description="Any of 'role', 'active', 'prefix'"),
+        'set': fields.Raw(required=True, description="Any of 'first_name', 'last_name', 'active', 'role'")
+    })
+
+    batch_delete_model = api.model('BatchDelete', {
+        'ids': fields.List(fields.Integer()),
+        'filter': fields.Raw(description="Any of 'role', 'active', 'prefix'")
+    })
+
+    @user_ns.route('/batch')
+    class UserBatch(Resource):
+        @user_ns.expect(batch_update_model)
+        @user_ns.doc(params={'Authorization': {'in': 'header', 'description': 'Required JWT token', 'required': True}})
+        @jwt_required()
+        def patch(self):
+            '''Update every matching user in one statement'''
+            try:
+                current_user = get_jwt_identity()
+                if current_user['role'] != 'ADMIN':
+                    return {'msg': "Only ADMIN can update information."}, 403
+
+                data = request.get_json(silent=True)
+                clauses, error = batch_target(data)
+                if error:
+                    return {'msg': error}, 400
+                values = data.get('set')
+                if not isinstance(values, dict) or not values:
+                    return {'msg': "'set' must be a non-empty object."}, 400
+                unknown = set(values) - BATCH_UPDATABLE
+                if unknown:
+                    return {'msg': f"Cannot batch update: {', '.join(sorted(unknown))}."}, 400
+                changes = dict(values)
+                if 'role' in values:
+                    if values['role'] not in UserRole.__members__:
+                        return {'msg': "Invalid role."}, 400
+                    values['role'] = UserRole[values['role']]
+                if 'active' in values and not isinstance(values['active'], bool):
+                    return {'msg': "'active' must be a boolean."}, 400
+                values['updated_at'] = datetime.utcnow()
+                revoke = 'active' in values or 'role' in values
+                if revoke:
+                    values['token_version'] = User.token_version + 1
+
+                # Same rule as PUT: other ADMINs are off limits, yourself is not.
+                statement = update(User).where(
+                    User.deleted_at.is_(None), *clauses,
+                    or_(User.role != UserRole.ADMIN, User.id == current_user['id'])
+                ).values(**values)
+                rows = run_batch(statement)
+                db.session.commit()
+
+                cache.delete(*[profile_key(row.username) for row in rows])
+                if revoke:
+                    revocations.revoke_many((row.id, row.token_version) for row in rows)
+                audit.record_many('user_updated', [row.id for row in rows], current_user['id'], fields=changes)
+                return {'msg': "Users updated.", 'affected': len(rows)}, 200
+            except Exception as e:
+                db.session.rollback()
+                return {'msg': f"An error occurred: {str(e)}"}, 500
+
+        @user_ns.expect(batch_delete_model)
+        @user_ns.doc(params={'Authorization': {'in': 'header', 'description': 'Required JWT token', 'required': True}})
+        @jwt_required()
+        def delete(self):
+            '''Soft-delete every matching user in one statement'''
+            try:
+                current_user = get_jwt_identity()
+                if current_user['role'] != 'ADMIN':
+                    return {'msg': "Permission denied. Only ADMIN can access."}, 403
+
+                clauses, error = batch_target(request.get_json(silent=True))
+                if error:
+                    return {'msg': error}, 400
+
+                # Same rule as DELETE: never an ADMIN, never yourself.
+                now = datetime.utcnow()
+                statement = update(User).where(
+                    User.deleted_at.is_(None), *clauses,
+                    User.role != UserRole.ADMIN, User.id != current_user['id']
+                ).values(deleted_at=now, updated_at=now, token_version=User.token_version + 1)
+                rows = run_batch(statement)
+                db.session.commit()
+
+                cache.delete(*[profile_key(row.username) for row in rows])
+                revocations.revoke_many((row.id, row.token_version) for row in rows)
+                audit.record_many('user_deleted', [row.id for row in rows], current_user['id'])
+                return {'msg': "Users deleted.", 'affected': len(rows)}, 200
+            except Exception as e:
+                db.session.rollback()
+                return {'msg': f"An error occurred: {str(e)}"}, 500
+
     @user_ns.route('/<string:username>')
     class UserResource(Resource):
-        @user_ns.marshal_with(user_model)
-        @user_ns.doc(params={'Authorization': {'in': 'header', 'description': 'Required JWT token', 'required': True}})
+        @user_ns.response(200, 'Success', user_model)
+        @user_ns.response(304, 'Not modified')
+        @user_ns.doc(params={
+            'Authorization': {'in': 'header', 'description': 'Required JWT token', 'required': True},
+            'If-None-Match': {'in': 'header', 'description': 'ETag from an earlier response'},
+            'If-Modified-Since': {'in': 'header', 'description': 'Last-Modified from an earlier response'}
+        })
         @jwt_required()
         def get(self, username):
-            '''Get user details'''
+            '''Get user details
+
+            Sends ETag and Last-Modified, and answers 304 to a matching
+            If-None-Match or If-Modified-Since. That is decided from the cache,
+            or on a miss from updated_at alone, before anything is serialized.
+            '''
             current_user = get_jwt_identity()
             if current_user['role'] != 'ADMIN' and current_user['username'] != username:
                 api.abort(403, "Permission denied.")
-            
-            user = User.query.filter_by(username=username).first()
-            if not user:
-                api.abort(404, "User not found.")
-            return user
+
+            key = profile_key(username)
+            conditions = request.headers.get('If-None-Match'), request.headers.get('If-Modified-Since')
+            entry = cache.get(key)
+            if entry is not None:
+                etag, last_modified, payload = unpack(entry)
+            else:
+                generation = cache.generation(key)
+                if any(conditions):
+                    row = db.session.execute(
+                        select(User.id, User.updated_at).where(User.username == username, User.deleted_at.is_(None))
+                    ).first()
+                    if not row:
+                        api.abort(404, "User not found.")
+                    etag, last_modified = validators(row.id, row.updated_at)
+                    if not_modified(*conditions, etag, last_modified):
+                        return current_app.response_class(
+                            status=304, headers={'ETag': etag, 'Last-Modified': last_modified})
+                user = User.query.filter_by(username=username, deleted_at=None).first()
+                if not user:
+                    api.abort(404, "User not found.")
+                payload = serializer.dump(user_model, user)
+                etag, last_modified = validators(user.id, user.updated_at)
+                cache.set(key, pack(etag, last_modified, payload), generation)
+            headers = {'ETag': etag, 'Last-Modified': last_modified}
+            if not_modified(*conditions, etag, last_modified):
+                return current_app.response_class(status=304, headers=headers)
+            return current_app.response_class(payload, mimetype='application/json', headers=headers)
 
         @user_ns.expect(user_model)
-        @user_ns.doc(params={'Authorization': {'in': 'header', 'description': 'Required JWT token', 'required': True}})
+        @user_ns.response(412, 'Modified since the If-Match ETag')
+        @user_ns.doc(params={
+            'Authorization': {'in': 'header', 'description': 'Required JWT token', 'required': True},
+            'If-Match': {'in': 'header', 'description': 'Only update if the user still has this ETag'}
+        })
         @jwt_required()
         def put(self, username):
             '''Update user details'''
@@ -151,19 +648,31 @@ def register_routes(api):
                     return {'msg': "Request body must be JSON."}, 400
 
                 current_user = get_jwt_identity()
-                current_user_role = current_user['role']
+                if current_user['role'] != 'ADMIN':
+                    return {'msg': "Only ADMIN can update information."}, 403
 
-                user = User.query.filter_by(username=username).first()
+                if_match = request.headers.get('If-Match')
+                query = User.query.filter_by(username=username, deleted_at=None)
+                if if_match:
+                    # Hold the row until commit so no one else updates it in between.
+                    query = query.with_for_update()
+                user = query.first()
                 if not user:
                     return {'msg': "User not found."}, 404
 
-                if current_user_role == 'ADMIN':
-                    if user.role == 'ADMIN' and current_user['username'] != username:
-                        return {'msg': "Permission denied. You cannot update another ADMIN."}, 403
-                else:
-                    return {'msg': "Only ADMIN can update information."}, 403
+                if user.role == UserRole.ADMIN and current_user['username'] != username:
+                    return {'msg': "Permission denied. You cannot update another ADMIN."}, 403
+
+                if if_match:
+                    etag, _ = validators(user.id, user.updated_at)
+                    if precondition_failed(if_match, etag):
+                        db.session.rollback()
+                        return {'msg': "User has been modified since it was read."}, 412, {'ETag': etag}
 
                 updated_fields = {}
+                if 'username' in data and reserved_username(data['username']):
+                    db.session.rollback()
+                    return {'msg': "This username is reserved."}, 400
                 if 'username' in data:
                     user.username = data['username']
                     updated_fields['username'] = user.username
@@ -185,33 +694,60 @@ def register_routes(api):
                     user.role = UserRole[data['role']]
                     updated_fields['role'] = user.role.name
 
+                version = None
+                if updated_fields.keys() & {'username', 'active', 'role'} or 'password' in data:
+                    version = user.revoke_tokens()
+                if db.session.is_modified(user):
+                    # Set here rather than by onupdate, so the new ETag is known without a reload.
+                    user.updated_at = datetime.utcnow()
+                user_id, new_username, updated_at = user.id, user.username, user.updated_at
                 db.session.commit()
-                return {'msg': "User details updated."}, 200
+                cache.delete(profile_key(username), profile_key(new_username))
+                if version is not None:
+                    revocations.revoke(user_id, version)
+                audit.record('user_updated', user_id, current_user['id'],
+                             fields=updated_fields, password_changed='password' in data)
+                etag, last_modified = validators(user_id, updated_at)
+                return {'msg': "User details updated."}, 200, {'ETag': etag, 'Last-Modified': last_modified}
             
+            except HashingBusy as e:
+                db.session.rollback()
+                return hashing_busy(e)
             except Exception as e:
                 return {'msg': f"An error occurred: {str(e)}"}, 500
 
         @user_ns.doc(params={'Authorization': {'in': 'header', 'description': 'Required JWT token', 'required': True}})
         @jwt_required()
         def delete(self, username):
-            '''Delete a user'''
+            '''Delete a user
+
+            The row is kept with deleted_at set until the background purge
+            removes it; the user is gone from every endpoint immediately.
+            '''
             try:
                 current_user = get_jwt_identity()
                 if not current_user:
                     return {'msg': "Invalid token or user not found."}, 401
 
-                user = User.query.filter_by(username=username).first()
-                if not user:
-                    return {'msg': "User not found."}, 404
-
                 if current_user['role'] != 'ADMIN':
                     return {'msg': "Permission denied. Only ADMIN can access."}, 403
 
-                if current_user['username'] == username or user.role == 'ADMIN':
+                if current_user['username'] == username:
+                    return {'msg': "Permission denied. You cannot delete an ADMIN and yourself."}, 403
+
+                user = User.query.filter_by(username=username, deleted_at=None).first()
+                if not user:
+                    return {'msg': "User not found."}, 404
+
+                if user.role == UserRole.ADMIN:
                     return {'msg': "Permission denied. You cannot delete an ADMIN and yourself."}, 403
 
-                db.session.delete(user)
+                version = user.soft_delete()
+                user_id = user.id
                 db.session.commit()
+                revocations.revoke(user_id, version)
+                cache.delete(profile_key(username))
+                audit.record('user_deleted', user_id, current_user['id'], username=username)
                 return {'msg': "User deleted."}, 200
 
             except Exception as e:
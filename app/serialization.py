@@ -0,0 +1,149 @@
+import json
+from flask_restx import fields, marshal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _to_str(value):
+    return None if value is None else str(value)
+
+
+def _to_int(value):
+    return None if value is None else int(value)
+
+
+def _to_bool(value):
+    return None if value is None else bool(value)
+
+
+CONVERTERS = {
+    fields.String: _to_str,
+    fields.Integer: _to_int,
+    fields.Boolean: _to_bool,
+}
+
+JSON_TYPES = {
+    fields.String: (str,),
+    fields.Integer: (int,),
+    fields.Boolean: (bool,),
+}
+
+
+def _field_class(field):
+    for cls in type(field).__mro__:
+        if cls in CONVERTERS:
+            return cls
+    return None
+
+
+def compile_encoder(model):
+    '''Compile an api.model into a function that builds its output dict.
+
+    The generated function reads each attribute once and applies the same
+    conversion the RESTX field would, so the output matches marshal() for the
+    field types used by this API. Models with other field types fall back to
+    marshal().
+    '''
+    namespace = {'_missing': object()}
+    lines = ['def encode(obj):']
+    items = []
+    for index, (key, field) in enumerate(model.items()):
+        cls = _field_class(field)
+        if cls is None:
+            return lambda obj: marshal(obj, model)
+        attribute = field.attribute or key
+        if not isinstance(attribute, str) or not attribute.isidentifier():
+            return lambda obj: marshal(obj, model)
+        namespace[f'_convert{index}'] = CONVERTERS[cls]
+        namespace[f'_default{index}'] = field.default
+        lines.append(f'    v{index} = getattr(obj, {attribute!r}, None)')
+        lines.append(f'    v{index} = _default{index} if v{index} is None else _convert{index}(v{index})')
+        items.append(f'{key!r}: v{index}')
+    lines.append('    return {' + ', '.join(items) + '}')
+    exec('\n'.join(lines), namespace)
+    return namespace['encode']
+
+
+def compile_validator(model):
+    '''Compile an api.model into a check of required keys and JSON types.
+
+    Returns a function that maps a request body to an errors dict, or None if
+    the body is valid.
+    '''
+    checks = []
+    for key, field in model.items():
+        cls = _field_class(field)
+        if cls is None or getattr(field, 'readonly', False):
+            continue
+        checks.append((key, bool(field.required), JSON_TYPES[cls], cls is fields.Integer))
+
+    def validate(data):
+        if not isinstance(data, dict):
+            return {'': "Request body must be a JSON object."}
+        errors = None
+        for key, required, types, is_int in checks:
+            if key not in data:
+                if required:
+                    errors = errors or {}
+                    errors[key] = f"'{key}' is a required property"
+                continue
+            value = data[key]
+            if value is not None and (not isinstance(value, types) or (is_int and isinstance(value, bool))):
+                errors = errors or {}
+                errors[key] = f"{value!r} is not of type '{types[0].__name__}'"
+        return errors
+
+    return validate
+
+
+class Serializer:
+    '''Opt-in fast path for model encoding and request validation.
+
+    With FAST_JSON off, dump() is marshal() plus json.dumps and validate()
+    accepts everything, exactly as before. With it on, models are compiled
+    once into specialized encoders/validators and encoded with orjson when it
+    is installed.
+    '''
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._encoders = {}
+        self._validators = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('FAST_JSON', False)
+        app.extensions['serializer'] = self
+
+    def encoder(self, model):
+        encode = self._encoders.get(model.name)
+        if encode is None:
+            encode = self._encoders[model.name] = compile_encoder(model)
+        return encode
+
+    def validator(self, model):
+        validate = self._validators.get(model.name)
+        if validate is None:
+            validate = self._validators[model.name] = compile_validator(model)
+        return validate
+
+    def dump(self, model, obj):
+        '''Serialize obj in the shape of model, as JSON bytes.'''
+        if not self.enabled:
+            return json.dumps(marshal(obj, model)).encode()
+        return dumps(self.encoder(model)(obj))
+
+    def validate(self, model, data):
+        if not self.enabled:
+            return None
+        return self.validator(model)(data)
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    '''Single-node stand-in: there are no other nodes to tell.'''
+
+    def publish(self, channel, message):
+        pass
+
+    def subscribe(self, channel, handler):
+        pass
+
+    def start(self, timeout=None):
+        return True
+
+
+class RedisBackend:
+    '''Pub/sub over a Redis-protocol server.
+
+    One listener thread per process dispatches messages to the handlers of
+    each channel. If the connection drops, handlers are called with None once
+    it is back, since messages sent in between are lost.
+    '''
+
+    def __init__(self, client, prefix='shared:'):
+        self.client = client
+        self.prefix = prefix
+        self._handlers = {}
+        self._thread = None
+        self._lock = threading.Lock()
+        self._subscribed = threading.Event()
+        self._missed = False
+
+    def publish(self, channel, message):
+        self.client.publish(self.prefix + channel, message)
+
+    def subscribe(self, channel, handler):
+        with self._lock:
+            self._handlers.setdefault(self.prefix + channel, []).append(handler)
+
+    def start(self, timeout=None):
+        if not self._handlers:
+            return True
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='shared-state', daemon=True)
+                    self._thread.start()
+        return self._subscribed.wait(timeout) if timeout else self._subscribed.is_set()
+
+    def _run(self):
+        delay = 1
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                subscribed = set()
+                while True:
+                    channels = set(self._handlers) - subscribed
+                    if channels:
+                        pubsub.subscribe(*channels)
+                        if not subscribed:
+                            # redis-py reconnects and resubscribes on its own;
+                            # this is the only sign that messages were missed.
+                            pubsub.connection.register_connect_callback(self._reconnected)
+                        subscribed |= channels
+                    self._subscribed.set()
+                    if self._missed:
+                        self._missed = False
+                        for channel in subscribed:
+                            self._dispatch(channel, None)
+                    message = pubsub.get_message(timeout=1.0)
+                    delay = 1
+                    if message and message['type'] == 'message':
+                        self._dispatch(message['channel'].decode(), message['data'])
+            except Exception:
+                logger.warning("Shared state subscription lost; reconnecting in %s s", delay, exc_info=True)
+                self._missed = True
+                self._subscribed.clear()
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+            finally:
+                pubsub.close()
+
+    def _reconnected(self, connection):
+        self._missed = True
+
+    def _dispatch(self, channel, data):
+        for handler in self._handlers.get(channel, ()):
+            try:
+                handler(data)
+            except Exception:
+                logger.exception("Shared state handler failed on %s", channel)
+
+
+class SharedState:
+    '''Cross-node coordination for the per-process caches.
+
+    SHARED_STATE_BACKEND='memory' is a single node and publishes nothing.
+    With 'redis', every node shares one client per URL for the Redis-backed
+    cache, rate limiter and revocation store, and publish() reaches the
+    subscribers on every other node, usually within milliseconds.
+    '''
+
+    def __init__(self, app=None):
+        self.backend = MemoryBackend()
+        self.url = None
+        self._clients = {}
+        self._node = uuid.uuid4().hex
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.url = app.config.get('SHARED_STATE_REDIS_URL')
+        if app.config.get('SHARED_STATE_BACKEND', 'memory') == 'redis':
+            self.backend = RedisBackend(self.redis_client())
+        else:
+            self.backend = MemoryBackend()
+        app.extensions['shared_state'] = self
+        app.before_request(self._before_request)
+
+    @property
+    def node_id(self):
+        # Forked workers inherit the module state, so the pid tells them apart.
+        return f'{self._node}:{os.getpid()}'
+
+    def redis_client(self, url=None):
+        '''One client, and so one connection pool, per URL for the whole process.'''
+        url = url or self.url
+        client = self._clients.get(url)
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("Redis-backed shared state requires the redis package.")
+            client = self._clients[url] = redis.Redis.from_url(url)
+        return client
+
+    def publish(self, channel, data):
+        '''Send data to the other nodes' subscribers of channel.
+
+        Failures are logged, not raised: the change has already committed, and
+        nodes that lose the connection reset their state when it comes back.
+        '''
+        try:
+            self.backend.publish(channel, json.dumps({'node': self.node_id, 'data': data}))
+        except Exception:
+            logger.warning("Could not publish to %s", channel, exc_info=True)
+
+    def subscribe(self, channel, handler):
+        '''Call handler(data) for messages on channel from other nodes.
+
+        handler(None) means messages may have been missed and any local
+        state kept in sync by the channel should be reset.
+        '''
+        def receive(message):
+            if message is None:
+                return handler(None)
+            message = json.loads(message)
+            if message['node'] != self.node_id:
+                handler(message['data'])
+
+        self.backend.subscribe(channel, receive)
+
+    def _before_request(self):
+        self.start()
+
+    def start(self, timeout=None):
+        '''Start listening. With a timeout, wait that long for the subscriptions
+        and return whether they are in place.'''
+        return self.backend.start(timeout)
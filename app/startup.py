@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from flask import jsonify
+
+logger = logging.getLogger(__name__)
+
+
+class StartupReport:
+    '''Wall time of each startup phase, from package import until ready.'''
+
+    def __init__(self, started):
+        self.started = started
+        self.phases = []
+        self.ready_at = None
+
+    def add(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def as_dict(self):
+        end = self.ready_at or time.perf_counter()
+        return {
+            'ready': self.ready_at is not None,
+            'total_ms': round((end - self.started) * 1000, 1),
+            'phases': [{'name': name, 'ms': round(seconds * 1000, 1)} for name, seconds in self.phases],
+        }
+
+
+def warm_pool(engine, connections):
+    '''Open up to `connections` pooled connections and return them to the pool.'''
+    size = getattr(engine.pool, 'size', None)
+    if callable(size):
+        connections = min(connections, size())
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+
+
+class Startup:
+    '''Startup report, warm-up and the /ready endpoint.
+
+    With PRODUCTION_MODE on, a background thread opens DB_POOL_WARM
+    connections per engine, starts the hashing workers and loads the
+    revocation store, and /ready answers 503 until that is done. Otherwise the
+    app is ready as soon as create_app() returns.
+    '''
+
+    def __init__(self):
+        self.report = None
+        self._thread = None
+
+    def init_app(self, app, report):
+        self.report = report
+        app.extensions['startup'] = self
+        app.add_url_rule('/ready', 'ready', self.ready)
+        if app.config.get('PRODUCTION_MODE', False) and app.config.get('WARMUP_ON_START', True):
+            self._thread = threading.Thread(target=self._warm_up, args=(app,), name='warm-up', daemon=True)
+            self._thread.start()
+        else:
+            self._finish(app)
+
+    def ready(self):
+        '''Readiness probe: 200 once warmed up, 503 before.'''
+        report = self.report.as_dict()
+        return jsonify(report), 200 if report['ready'] else 503
+
+    def _warm_up(self, app):
+        from . import api, db, hasher, revocations, serializer, shared
+        delay = 1
+        while True:
+            try:
+                with app.app_context():
+                    with self.report.phase('warm_pool'):
+                        for engine in db.engines.values():
+                            warm_pool(engine, app.config.get('DB_POOL_WARM', 2))
+                    with self.report.phase('warm_hashing'):
+                        hasher.warm()
+                    # Subscribe first so nothing revoked during the load is missed.
+                    with self.report.phase('shared_state'):
+                        if not shared.start(timeout=5):
+                            raise RuntimeError("Shared state subscription could not be set up.")
+                    with self.report.phase('warm_revocations'):
+                        if not revocations.warm():
+                            raise RuntimeError("Revocation store could not be loaded.")
+                    if serializer.enabled:
+                        with self.report.phase('warm_serializer'):
+                            for model in api.models.values():
+                                serializer.encoder(model)
+                                serializer.validator(model)
+                break
+            except Exception:
+                logger.exception("Warm-up failed; retrying in %s s", delay)
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+        self._finish(app)
+
+    def _finish(self, app):
+        self.report.ready_at = time.perf_counter()
+        report = self.report.as_dict()
+        app.logger.info("Ready in %.1f ms: %s", report['total_ms'],
+                        ', '.join(f"{phase['name']}={phase['ms']}ms" for phase in report['phases']))
@@ -0,0 +1,39 @@
+import threading
+from contextlib import contextmanager
+from .metrics import query_listeners
+
+
+@contextmanager
+def count_queries():
+    '''Collect the SQL statements the current thread executes inside the block.
+
+    Background threads (mail queue, rehashing) are left out, so test-client
+    requests are counted without noise.
+    '''
+    statements = []
+    thread = threading.get_ident()
+
+    def listener(conn, cursor, statement, parameters, executemany, elapsed, endpoint):
+        if threading.get_ident() == thread:
+            statements.append(statement)
+
+    query_listeners.append(listener)
+    try:
+        yield statements
+    finally:
+        query_listeners.remove(listener)
+
+
+@contextmanager
+def assert_max_queries(limit):
+    '''Fail if the block executes more than `limit` SQL statements.
+
+        with assert_max_queries(1):
+            client.get('/user/alice', headers=headers)
+    '''
+    with count_queries() as statements:
+        yield statements
+    if len(statements) > limit:
+        listing = '\n'.join(f'  {index}. {" ".join(statement.split())[:200]}'
+                            for index, statement in enumerate(statements, 1))
+        raise AssertionError(f"{len(statements)} queries executed, expected at most {limit}:\n{listing}")
@@ -1,26 +1,97 @@
-from itsdangerous import URLSafeTimedSerializer
-from flask import current_app, url_for
+import hashlib
+import hmac
+import threading
+import time
+from itsdangerous import BadData, URLSafeTimedSerializer
+from flask import current_app
+from flask_jwt_extended import create_access_token, create_refresh_token
 from .models import User
 from flask_mail import Message
-from . import mail
+from . import db, mail_queue
+
+RESET_TOKEN_MAX_AGE = 3600
+
+
+class UsedTokenStore:
+    '''Remembers consumed tokens until they would have expired anyway.
+
+    Tokens are stored as 16-byte digests, and expired entries are swept
+    whenever the store grows past the size it had after the last sweep.
+    '''
+
+    def __init__(self):
+        self._expires = {}
+        self._lock = threading.Lock()
+        self._sweep_at = 1024
+
+    def claim(self, token, ttl):
+        '''Mark token as used. Returns False if it was already used.'''
+        key = hashlib.sha256(token.encode()).digest()[:16]
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._expires.get(key)
+            if expires_at is not None and expires_at > now:
+                return False
+            self._expires[key] = now + ttl
+            if len(self._expires) >= self._sweep_at:
+                self._expires = {k: exp for k, exp in self._expires.items() if exp > now}
+                self._sweep_at = max(1024, len(self._expires) * 2)
+        return True
+
+
+def create_tokens(user, refresh=True):
+    '''Access (and refresh) token for user, stamped with its token_version.'''
+    identity = {'id': user.id, 'username': user.username, 'role': user.role.name}
+    claims = {'ver': user.token_version or 0}
+    tokens = {'access_token': f'Bearer {create_access_token(identity=identity, additional_claims=claims)}'}
+    if refresh:
+        tokens['refresh_token'] = f'Bearer {create_refresh_token(identity=identity, additional_claims=claims)}'
+    return tokens
+
+def get_reset_serializer():
+    app = current_app._get_current_object()
+    serializer = app.extensions.get('reset_serializer')
+    if serializer is None:
+        serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt=app.config['SECURITY_PASSWORD_SALT'])
+        app.extensions['reset_serializer'] = serializer
+    return serializer
+
+def password_fingerprint(user):
+    '''Short keyed digest of the password hash; changes whenever the password does.'''
+    key = current_app.config['SECRET_KEY'].encode()
+    return hmac.new(key, user.password_hash.encode(), hashlib.sha256).hexdigest()[:16]
 
 def generate_reset_token(user):
-    serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
-    return serializer.dumps(user.email, salt=current_app.config['SECURITY_PASSWORD_SALT'])
+    return get_reset_serializer().dumps({'id': user.id, 'fp': password_fingerprint(user)})
 
-def verify_reset_token(token, expiration=3600):
-    serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
+def verify_reset_token(token, expiration=RESET_TOKEN_MAX_AGE):
     try:
-        email = serializer.loads(token, salt=current_app.config['SECURITY_PASSWORD_SALT'], max_age=expiration)
-    except:
+        data = get_reset_serializer().loads(token, max_age=expiration)
+        user_id, fingerprint = data['id'], data['fp']
+    except (BadData, TypeError, KeyError):
         return None
-    return User.query.filter_by(email=email).first()
+    if not isinstance(fingerprint, str):
+        return None
+    user = db.session.get(User, user_id)
+    if not user or user.deleted_at is not None or not hmac.compare_digest(fingerprint, password_fingerprint(user)):
+        return None
+    return user
+
+def claim_reset_token(token, expiration=RESET_TOKEN_MAX_AGE):
+    store = current_app.extensions.get('used_reset_tokens')
+    if store is None:
+        store = current_app.extensions['used_reset_tokens'] = UsedTokenStore()
+    return store.claim(token, expiration)
 
 def send_password_reset_email(user, token):
     msg = Message("Password Reset Request", sender="noreply@demo.com", recipients=[user.email])
-    msg.body = f'''To reset your password, visit the following link:
-{url_for('user_reset_password', token=token, _external=True)}
+    reset_url = current_app.config.get('PASSWORD_RESET_URL')
+    if reset_url:
+        instructions = f"To reset your password, visit the following link:\n{reset_url.format(token=token)}"
+    else:
+        instructions = f"To reset your password, submit this token with your new password:\n{token}"
+    msg.body = f'''{instructions}
 
 If you did not make this request then simply ignore this email and no changes will be made.
 '''
-    mail.send(msg)
+    mail_queue.enqueue(msg)
@@ -0,0 +1,137 @@
+'''Load test for the user API.
+
+Boots create_app() against a throwaway SQLite database (or --database-url),
+seeds users, then drives a weighted mix of register/login/get/put/delete at a
+fixed concurrency and reports per-endpoint latency percentiles and throughput.
+
+    python -m benchmarks.api --users 1000 --concurrency 8 --duration 15 --output api.json
+'''
+import argparse
+import itertools
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from .common import boot_app, seed_users, summarize, write_results
+
+MIXES = {
+    'read-heavy': {'get': 80, 'login': 10, 'put': 10},
+    'mixed': {'register': 10, 'login': 20, 'get': 50, 'put': 15, 'delete': 5},
+    'login': {'login': 100},
+}
+
+
+class Driver:
+    '''Operations of the mix. Each worker thread passes its own RNG.'''
+
+    def __init__(self, app, users, password, admin_token, seed):
+        self.app = app
+        self.users = users
+        self.password = password
+        self.auth = {'Authorization': admin_token}
+        self.seed = seed
+        self.serial = itertools.count()
+        self.registered = []
+        self.lock = threading.Lock()
+
+    def register(self, client, rng):
+        n = next(self.serial)
+        response = client.post('/user/register', json={
+            'username': f'new{n}', 'first_name': 'New', 'last_name': str(n),
+            'email': f'new{n}@bench.local', 'password': self.password
+        })
+        if response.status_code == 201:
+            with self.lock:
+                self.registered.append(f'new{n}')
+        return response
+
+    def login(self, client, rng):
+        username = f'user{rng.randrange(self.users)}'
+        return client.post('/user/login', json={'username': username, 'password': self.password})
+
+    def get(self, client, rng):
+        return client.get(f'/user/user{rng.randrange(self.users)}', headers=self.auth)
+
+    def put(self, client, rng):
+        username = f'user{rng.randrange(self.users)}'
+        return client.put(f'/user/{username}', headers=self.auth,
+                          json={'first_name': f'Bench{rng.randrange(1000)}'})
+
+    def delete(self, client, rng):
+        '''Delete a user registered by the run, or return None if none is left.'''
+        with self.lock:
+            username = self.registered.pop() if self.registered else None
+        if username is None:
+            return None
+        return client.delete(f'/user/{username}', headers=self.auth)
+
+
+def run(app, driver, mix, concurrency, duration):
+    operations = list(mix)
+    weights = [mix[op] for op in operations]
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        # Per-thread RNG seeded from --seed, so each worker's sequence is reproducible.
+        rng = random.Random(f'{driver.seed}:{index}')
+        client = app.test_client()
+        local = defaultdict(list)
+        local_status = defaultdict(lambda: defaultdict(int))
+        while time.perf_counter() < deadline:
+            op = rng.choices(operations, weights)[0]
+            start = time.perf_counter()
+            response = getattr(driver, op)(client, rng)
+            if response is None:
+                # Nothing left to delete: register instead, and count it as that.
+                op = 'register'
+                start = time.perf_counter()
+                response = driver.register(client, rng)
+            local[op].append(time.perf_counter() - start)
+            local_status[op][response.status_code] += 1
+        return local, local_status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for local, local_status in pool.map(worker, range(concurrency)):
+            for op, samples in local.items():
+                latencies[op].extend(samples)
+            for op, counts in local_status.items():
+                for status, count in counts.items():
+                    statuses[op][status] += count
+    elapsed = time.perf_counter() - start
+
+    results = {op: {**summarize(samples, elapsed), 'status': dict(statuses[op])}
+               for op, samples in sorted(latencies.items())}
+    results['total'] = summarize([s for samples in latencies.values() for s in samples], elapsed)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Defaults to a fresh SQLite file.')
+    parser.add_argument('--users', type=int, default=1000, help='Users to seed.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per mix.')
+    parser.add_argument('--mix', choices=sorted(MIXES), action='append', help='Repeatable; defaults to all.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report here.')
+    args = parser.parse_args(argv)
+
+    app = boot_app(args.database_url)
+    password = seed_users(app, args.users)
+    login = app.test_client().post('/user/login', json={'username': 'bench-admin', 'password': password})
+    driver = Driver(app, args.users, password, login.json['access_token'], args.seed)
+
+    results = {}
+    for name in args.mix or sorted(MIXES):
+        results[name] = run(app, driver, MIXES[name], args.concurrency, args.duration)
+    params = {key: value for key, value in vars(args).items() if key != 'output'}
+    params['database_url'] = app.config['SQLALCHEMY_DATABASE_URI']
+    write_results(args.output, 'api', params, results)
+
+
+if __name__ == '__main__':
+    main()
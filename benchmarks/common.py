@@ -0,0 +1,98 @@
+import json
+import os
+import platform
+import statistics
+import tempfile
+from datetime import datetime
+
+
+def configure_environment(database_url=None):
+    '''Point the app at a throwaway database and switch off side effects.
+
+    Must run before `config` is imported, since Config reads the environment
+    at import time.
+    '''
+    if database_url is None:
+        database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='user-bench-'), 'bench.db')
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('RATELIMIT_ENABLED', 'False')
+    os.environ.setdefault('MAIL_QUEUE_WORKER', 'False')
+    os.environ.setdefault('MAIL_SUPPRESS_SEND', 'True')
+    return database_url
+
+
+def boot_app(database_url=None):
+    configure_environment(database_url)
+    from app import create_app, db
+    app = create_app()
+    app.config['MAIL_SUPPRESS_SEND'] = True
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app
+
+
+def seed_users(app, count, password='bench-password', admin='bench-admin'):
+    '''Insert `count` users sharing one password hash, plus one ADMIN.'''
+    from app import db
+    from app.models import User, UserRole
+    from sqlalchemy import insert
+    with app.app_context():
+        template = User(username='-', first_name='-', last_name='-', email='-@-')
+        template.set_password(password)
+        password_hash = template.password_hash
+        now = datetime.utcnow()
+        rows = [{
+            'username': f'user{i}', 'first_name': 'Bench', 'last_name': str(i),
+            'email': f'user{i}@bench.local', 'password_hash': password_hash,
+            'role': UserRole.USER, 'active': True, 'created_at': now, 'updated_at': now
+        } for i in range(count)]
+        rows.append({
+            'username': admin, 'first_name': 'Bench', 'last_name': 'Admin',
+            'email': f'{admin}@bench.local', 'password_hash': password_hash,
+            'role': UserRole.ADMIN, 'active': True, 'created_at': now, 'updated_at': now
+        })
+        for start in range(0, len(rows), 1000):
+            db.session.execute(insert(User), rows[start:start + 1000])
+        db.session.commit()
+    return password
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarize(samples, elapsed=None):
+    '''Latency summary in milliseconds for a list of durations in seconds.'''
+    ordered = sorted(samples)
+    summary = {
+        'count': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000 if ordered else None,
+        'p50_ms': percentile(ordered, 0.50) * 1000 if ordered else None,
+        'p95_ms': percentile(ordered, 0.95) * 1000 if ordered else None,
+        'p99_ms': percentile(ordered, 0.99) * 1000 if ordered else None,
+        'max_ms': ordered[-1] * 1000 if ordered else None,
+    }
+    if elapsed:
+        summary['rps'] = len(ordered) / elapsed
+    return summary
+
+
+def write_results(path, name, params, results):
+    report = {
+        'benchmark': name,
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': params,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return report
@@ -0,0 +1,41 @@
+'''Compare two benchmark reports written with --output.
+
+    python -m benchmarks.compare baseline.json candidate.json
+'''
+import argparse
+import json
+
+FIELDS = ('p50_ms', 'p95_ms', 'p99_ms', 'rps')
+
+
+def flatten(results, prefix=''):
+    for name, value in sorted(results.items()):
+        if isinstance(value, dict) and any(field in value for field in FIELDS):
+            yield prefix + name, value
+        elif isinstance(value, dict):
+            yield from flatten(value, f'{prefix}{name}.')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = dict(flatten(json.load(f)['results']))
+    with open(args.candidate) as f:
+        candidate = dict(flatten(json.load(f)['results']))
+
+    print(f"{'metric':40} {'field':8} {'baseline':>12} {'candidate':>12} {'change':>8}")
+    for name in sorted(baseline.keys() & candidate.keys()):
+        for field in FIELDS:
+            old, new = baseline[name].get(field), candidate[name].get(field)
+            if old is None or new is None:
+                continue
+            change = f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+            print(f'{name:40} {field:8} {old:12.3f} {new:12.3f} {change:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+'''CPU versus bytes for response compression.
+
+Builds realistic payloads from seeded users, namely a List Users page and the
+NDJSON export, and for each encoding and level reports compression time,
+compressed size and ratio. The export is compressed the way streamed
+responses are, flushing every COMPRESS_STREAM_FLUSH_SIZE bytes, and once
+more flushing after every row to show what too-frequent flushes cost.
+Brotli levels are included when the brotli package is installed.
+
+    python -m benchmarks.compression --users 2000 --output compression.json
+'''
+import argparse
+from .common import boot_app, seed_users, write_results
+from .micro import measure
+
+GZIP_LEVELS = (1, 3, 6, 9)
+BROTLI_LEVELS = (1, 4, 6, 9, 11)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--page-size', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--output', help='Write the JSON report here.')
+    args = parser.parse_args(argv)
+
+    app = boot_app()
+    password = seed_users(app, args.users)
+
+    from app import compressor
+    from app.compression import brotli
+
+    client = app.test_client()
+    token = client.post('/user/login', json={'username': 'bench-admin', 'password': password}).json['access_token']
+    identity = {'Authorization': token, 'Accept-Encoding': 'identity'}
+    page = client.get(f'/user/?limit={args.page_size}', headers=identity).get_data()
+    export = client.get('/user/export', headers=identity, buffered=False)
+    rows = list(export.response)
+    export.close()
+
+    levels = [('gzip', level) for level in GZIP_LEVELS]
+    if brotli is not None:
+        levels += [('br', level) for level in BROTLI_LEVELS]
+
+    def compress_page():
+        encoder = compressor.encoder(encoding)
+        return encoder.compress(page) + encoder.finish()
+
+    def compress_export():
+        return b''.join(compressor._stream(iter(rows), encoding))
+
+    flush_size, configured = compressor.flush_size, dict(compressor.levels)
+    export_size = sum(len(row) for row in rows)
+    results = {}
+    for encoding, level in levels:
+        compressor.levels[encoding] = level
+        name = f'{encoding}-{level}'
+        size = len(compress_page())
+        results[f'{name}.page'] = dict(measure(compress_page, args.iterations), bytes=size, ratio=len(page) / size)
+        for flush, label in ((flush_size, 'export'), (0, 'export_flush_per_row')):
+            compressor.flush_size = flush
+            size = len(compress_export())
+            results[f'{name}.{label}'] = dict(measure(compress_export, max(1, args.iterations // 10)),
+                                              bytes=size, ratio=export_size / size)
+        compressor.flush_size = flush_size
+
+    compressor.levels = configured
+    for encoding in ('identity', 'gzip'):
+        headers = {'Authorization': token, 'Accept-Encoding': encoding}
+        results[f'request.list.{encoding}'] = measure(
+            lambda: client.get(f'/user/?limit={args.page_size}', headers=headers).get_data(), args.iterations)
+
+    params = {'users': args.users, 'page_size': args.page_size, 'iterations': args.iterations,
+              'page_bytes': len(page), 'export_bytes': export_size, 'stream_flush_size': flush_size,
+              'brotli': brotli is not None}
+    write_results(args.output, 'compression', params, results)
+
+
+if __name__ == '__main__':
+    main()
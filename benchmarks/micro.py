@@ -0,0 +1,62 @@
+'''Micro-benchmarks for the per-request building blocks of the user API.
+
+    python -m benchmarks.micro --iterations 200 --output micro.json
+'''
+import argparse
+import json
+import time
+from .common import boot_app, seed_users, summarize, write_results
+
+
+def measure(fn, iterations, warmup=3):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200,
+                        help='Iterations for fast operations; hashing runs a tenth as many.')
+    parser.add_argument('--output', help='Write the JSON report here.')
+    args = parser.parse_args(argv)
+
+    app = boot_app()
+    password = seed_users(app, 1)
+
+    from flask_jwt_extended import create_access_token
+    from flask_restx import marshal
+    from app import api
+    from app.models import User
+    from app.utils import generate_reset_token, verify_reset_token
+
+    user_model = api.models['User']
+    hash_iterations = max(1, args.iterations // 10)
+    results = {}
+    with app.test_request_context():
+        user = User.query.filter_by(username='user0').first()
+        identity = {'id': user.id, 'username': user.username, 'role': user.role.name}
+        token = generate_reset_token(user)
+        scratch = User(username='x', first_name='x', last_name='x', email='x@x')
+
+        results['set_password'] = measure(lambda: scratch.set_password(password), hash_iterations)
+        results['check_password'] = measure(lambda: user.check_password(password), hash_iterations)
+        results['marshal_user_model'] = measure(lambda: marshal(user, user_model), args.iterations)
+        results['marshal_and_dump_user_model'] = measure(
+            lambda: json.dumps(marshal(user, user_model)), args.iterations)
+        results['create_access_token'] = measure(lambda: create_access_token(identity=identity), args.iterations)
+        results['generate_reset_token'] = measure(lambda: generate_reset_token(user), args.iterations)
+        results['verify_reset_token'] = measure(lambda: verify_reset_token(token), args.iterations)
+
+    params = {'iterations': args.iterations, 'hash_iterations': hash_iterations,
+              'hash_method': app.config.get('HASH_METHOD')}
+    write_results(args.output, 'micro', params, results)
+
+
+if __name__ == '__main__':
+    main()
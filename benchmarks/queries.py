@@ -0,0 +1,105 @@
+'''Query budgets per endpoint.
+
+Calls each endpoint once through the test client under assert_max_queries()
+and fails with the offending statements if any handler issues more SQL than
+its budget, e.g. an extra lookup or an N+1 loop. The database is warmed
+first, so one-off start-up queries are not counted.
+
+    python -m benchmarks.queries --output queries.json
+'''
+import argparse
+import sys
+from .common import boot_app, seed_users, write_results
+
+BUDGETS = {
+    'register': 1,
+    'login': 1,
+    'get': 1,
+    'get_cached': 0,
+    'get_not_modified_cached': 0,
+    'put': 2,
+    'get_not_modified': 1,
+    'put_if_match': 2,
+    'list': 1,
+    'batch_update': 1,
+    'forget_password': 2,
+    'reset_password': 2,
+    'delete': 2,
+    'batch_delete': 1,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='Write the JSON report here.')
+    args = parser.parse_args(argv)
+
+    app = boot_app()
+    password = seed_users(app, 4)
+
+    from app import revocations
+    from app.models import User
+    from app.testing import assert_max_queries
+    from app.utils import generate_reset_token
+
+    state = {}
+    with app.app_context():
+        revocations.warm()
+        # The token is only mailed, so reset_password gets one made up front.
+        state['token'] = generate_reset_token(User.query.filter_by(username='user1').one())
+    client = app.test_client()
+    admin = client.post('/user/login', json={'username': 'bench-admin', 'password': password}).json
+    auth = {'Authorization': admin['access_token']}
+
+    def get(name, **headers):
+        response = client.get('/user/user0', headers={**auth, **headers})
+        state[name] = response.headers.get('ETag')
+        return response
+
+    def put(name, **headers):
+        response = client.put('/user/user0', headers={**auth, **headers}, json={'first_name': name})
+        state['etag'] = response.headers.get('ETag')
+        return response
+
+    def forget_password():
+        return client.post('/user/forget_password', json={'username': 'user1', 'email': 'user1@bench.local'})
+
+    steps = {
+        'register': lambda: client.post('/user/register', json={
+            'username': 'fresh', 'first_name': 'F', 'last_name': 'F', 'email': 'fresh@bench.local', 'password': password}),
+        'login': lambda: client.post('/user/login', json={'username': 'user0', 'password': password}),
+        'get': lambda: get('etag'),
+        'get_cached': lambda: client.get('/user/user0', headers=auth),
+        'get_not_modified_cached': lambda: get('etag', **{'If-None-Match': state['etag']}),
+        'put': lambda: put('Changed'),
+        'get_not_modified': lambda: get('etag', **{'If-None-Match': state['etag']}),
+        'put_if_match': lambda: put('Again', **{'If-Match': state['etag']}),
+        'list': lambda: client.get('/user/?limit=50', headers=auth),
+        'batch_update': lambda: client.patch('/user/batch', headers=auth, json={
+            'filter': {'prefix': 'user'}, 'set': {'last_name': 'Batch'}}),
+        'forget_password': forget_password,
+        'reset_password': lambda: client.post('/user/reset_password', json={
+            'token': state['token'], 'new_password': 'changed-password'}),
+        'delete': lambda: client.delete('/user/user2', headers=auth),
+        'batch_delete': lambda: client.delete('/user/batch', headers=auth, json={'ids': [4]}),
+    }
+
+    results, failures = {}, []
+    for name, step in steps.items():
+        try:
+            with assert_max_queries(BUDGETS[name]) as statements:
+                response = step()
+        except AssertionError as e:
+            failures.append(f'{name}: {e}')
+        if response.status_code >= 400:
+            failures.append(f'{name}: HTTP {response.status_code} {response.get_data(as_text=True)[:200]}')
+        results[name] = {'queries': len(statements), 'budget': BUDGETS[name], 'status': response.status_code}
+
+    write_results(args.output, 'queries', {}, results)
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
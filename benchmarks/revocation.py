@@ -0,0 +1,66 @@
+'''Per-request cost of the token revocation check.
+
+Times the blocklist hook on its own, with `--revoked` users already revoked,
+against the full verify_jwt_in_request() it runs inside. Pass --redis-url to
+time the shared backend too.
+
+    python -m benchmarks.revocation --revoked 100000 --output revocation.json
+'''
+import argparse
+from .common import boot_app, seed_users, write_results
+from .micro import measure
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--revoked', type=int, default=100000, help='Users revoked before timing.')
+    parser.add_argument('--redis-url', help='Also time the Redis backend against this server.')
+    parser.add_argument('--output', help='Write the JSON report here.')
+    args = parser.parse_args(argv)
+
+    app = boot_app()
+    seed_users(app, 1)
+
+    from flask_jwt_extended import get_jwt, verify_jwt_in_request
+    from app import revocations, shared
+    from app.models import User
+    from app.revocation import MemoryBackend, RedisBackend
+    from app.utils import create_tokens
+
+    backends = {'memory': MemoryBackend()}
+    if args.redis_url:
+        backends['redis'] = RedisBackend(shared.redis_client(args.redis_url), prefix='bench-revoked:')
+
+    results = {}
+    with app.app_context():
+        user = User.query.filter_by(username='user0').first()
+        token = create_tokens(user, refresh=False)['access_token']
+        revoked_ids = range(user.id + 1, user.id + 1 + args.revoked)
+
+    headers = {'Authorization': token}
+    revocations._warmed = True
+    for name, backend in backends.items():
+        backend.set_many(((user_id, 1) for user_id in revoked_ids), revocations.ttl)
+        revocations.backend = backend
+        with app.test_request_context(headers=headers):
+            verify_jwt_in_request()
+            payload = get_jwt()
+            claim = revocations.identity_claim
+            revoked = {**payload, claim: dict(payload[claim], id=revoked_ids[0])}
+            results[f'{name}.hook_valid'] = measure(lambda: revocations.is_revoked(payload), args.iterations)
+            results[f'{name}.hook_revoked'] = measure(lambda: revocations.is_revoked(revoked), args.iterations)
+            results[f'{name}.verify_jwt_in_request'] = measure(verify_jwt_in_request, args.iterations)
+        results[f'{name}.hook_share'] = (
+            results[f'{name}.hook_valid']['mean_ms'] / results[f'{name}.verify_jwt_in_request']['mean_ms'])
+        if name == 'redis':
+            keys = list(backend.client.scan_iter('bench-revoked:*', count=10000))
+            for start in range(0, len(keys), 10000):
+                backend.client.delete(*keys[start:start + 10000])
+
+    params = {'iterations': args.iterations, 'revoked': args.revoked}
+    write_results(args.output, 'revocation', params, results)
+
+
+if __name__ == '__main__':
+    main()
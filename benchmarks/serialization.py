@@ -0,0 +1,66 @@
+'''Compare the RESTX marshalling path with the compiled FAST_JSON path.
+
+Encodes user_model payloads (one object, and a page of rows) and validates
+register/login bodies both ways, checking the outputs agree.
+
+    python -m benchmarks.serialization --iterations 2000 --output serialization.json
+'''
+import argparse
+import json
+from flask_restx import marshal
+from .common import boot_app, seed_users, write_results
+from .micro import measure
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--page-size', type=int, default=200)
+    parser.add_argument('--output', help='Write the JSON report here.')
+    args = parser.parse_args(argv)
+
+    app = boot_app()
+    seed_users(app, args.page_size)
+
+    from app import api, db
+    from app.models import User
+    from app.serialization import compile_encoder, compile_validator, dumps, orjson
+
+    user_model = api.models['User']
+    encode = compile_encoder(user_model)
+    results = {}
+    with app.app_context():
+        rows = db.session.query(
+            User.id, User.username, User.first_name, User.last_name,
+            User.email, User.role, User.active
+        ).limit(args.page_size).all()
+        user = User.query.first()
+        if json.loads(dumps(encode(user))) != marshal(user, user_model):
+            raise SystemExit('compiled encoder output differs from marshal()')
+
+        page_iterations = max(1, args.iterations // 20)
+        results['user.restx'] = measure(lambda: json.dumps(marshal(user, user_model)).encode(), args.iterations)
+        results['user.compiled'] = measure(lambda: dumps(encode(user)), args.iterations)
+        results['page.restx'] = measure(
+            lambda: json.dumps([marshal(row, user_model) for row in rows]).encode(), page_iterations)
+        results['page.compiled'] = measure(lambda: dumps([encode(row) for row in rows]), page_iterations)
+
+    for name, body in (
+        ('RegisterUser', {'username': 'u', 'first_name': 'f', 'last_name': 'l', 'email': 'e@x', 'password': 'p'}),
+        ('Login', {'username': 'u', 'password': 'p'}),
+    ):
+        model = api.models[name]
+        validate = compile_validator(model)
+        results[f'validate.{name}.restx'] = measure(lambda: model.validate(body), args.iterations)
+        results[f'validate.{name}.compiled'] = measure(lambda: validate(body), args.iterations)
+
+    for key in [k for k in results if k.endswith('.restx')]:
+        base = key[:-len('.restx')]
+        results[f'{base}.speedup'] = results[key]['mean_ms'] / results[f'{base}.compiled']['mean_ms']
+
+    params = {'iterations': args.iterations, 'page_size': args.page_size, 'orjson': orjson is not None}
+    write_results(args.output, 'serialization', params, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+'''Cross-node propagation of cache invalidations and token revocations.
+
+Starts two app processes on one SQLite database with SHARED_STATE_BACKEND=redis
+and a per-process memory cache, as if behind a load balancer. Node B caches a
+profile, node A updates it, and B is polled until it serves the new value;
+then A deactivates a user and B is polled until it refuses their token. Exits
+non-zero if either takes longer than --max-delay.
+
+Without --redis-url an in-process fakeredis server stands in for Redis.
+
+    python -m benchmarks.shared_state --rounds 20 --output shared_state.json
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from .common import boot_app, configure_environment, seed_users, summarize, write_results
+
+
+def run_node(database_url, redis_url, ports):
+    os.environ.update({
+        'SHARED_STATE_BACKEND': 'redis', 'SHARED_STATE_REDIS_URL': redis_url,
+        'CACHE_BACKEND': 'memory', 'REVOCATION_BACKEND': 'memory',
+    })
+    configure_environment(database_url)
+    from werkzeug.serving import make_server
+    from app import create_app, shared
+    app = create_app()
+    if not shared.start(timeout=10):
+        raise RuntimeError("Could not subscribe to shared state.")
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def call(port, method, path, token=None, body=None):
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}{path}', method=method,
+        data=json.dumps(body).encode() if body is not None else None,
+        headers={'Content-Type': 'application/json', **({'Authorization': token} if token else {})})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read() or 'null')
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def wait_for(check, max_delay):
+    '''Seconds until check() is true, or None after max_delay.'''
+    started = time.perf_counter()
+    while time.perf_counter() - started < max_delay:
+        if check():
+            return time.perf_counter() - started
+        time.sleep(0.001)
+    return None
+
+
+def start_fake_redis():
+    import fakeredis
+    server = fakeredis.TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'redis://127.0.0.1:{server.server_address[1]}/0'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--max-delay', type=float, default=1.0, help='Seconds allowed for a change to reach node B.')
+    parser.add_argument('--redis-url', help='Use this server instead of an in-process fakeredis.')
+    parser.add_argument('--output', help='Write the JSON report here.')
+    args = parser.parse_args(argv)
+
+    fake, redis_url = (None, args.redis_url) if args.redis_url else start_fake_redis()
+    database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='user-bench-'), 'bench.db')
+    password = seed_users(boot_app(database_url), args.rounds)
+
+    context = multiprocessing.get_context('spawn')
+    ports = context.Queue()
+    nodes = [context.Process(target=run_node, args=(database_url, redis_url, ports), daemon=True) for _ in range(2)]
+    for node in nodes:
+        node.start()
+    a, b = ports.get(timeout=60), ports.get(timeout=60)
+
+    try:
+        _, admin = call(a, 'POST', '/user/login', body={'username': 'bench-admin', 'password': password})
+        admin = admin['access_token']
+        invalidation, revocation, failures = [], [], []
+        for i in range(args.rounds):
+            username = f'user{i}'
+            name = f'Changed {i}'
+            call(b, 'GET', f'/user/{username}', admin)
+            call(a, 'PUT', f'/user/{username}', admin, {'first_name': name})
+            delay = wait_for(lambda: call(b, 'GET', f'/user/{username}', admin)[1]['first_name'] == name,
+                             args.max_delay)
+            if delay is None:
+                failures.append(f'{username}: node B still served the old profile after {args.max_delay} s')
+            else:
+                invalidation.append(delay)
+
+            _, tokens = call(b, 'POST', '/user/login', body={'username': username, 'password': password})
+            token = tokens['access_token']
+            call(b, 'GET', f'/user/{username}', token)
+            call(a, 'PUT', f'/user/{username}', admin, {'active': False})
+            delay = wait_for(lambda: call(b, 'GET', f'/user/{username}', token)[0] == 401, args.max_delay)
+            if delay is None:
+                failures.append(f'{username}: node B still accepted a revoked token after {args.max_delay} s')
+            else:
+                revocation.append(delay)
+    finally:
+        for node in nodes:
+            node.terminate()
+        if fake is not None:
+            fake.shutdown()
+            fake.server_close()
+
+    params = {'rounds': args.rounds, 'max_delay': args.max_delay, 'redis': 'external' if args.redis_url else 'fakeredis'}
+    write_results(args.output, 'shared_state', params, {
+        'cache_invalidation': summarize(invalidation),
+        'token_revocation': summarize(revocation),
+        'failures': failures,
+    })
+    if failures:
+        print('\n'.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import multiprocessing
+import os
+
+# WSGI:  gunicorn -c gunicorn.conf.py run:app
+# ASGI:  gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+
+bind = os.environ.get('BIND') or '0.0.0.0:8000'
+workers = int(os.environ.get('WEB_CONCURRENCY') or multiprocessing.cpu_count() * 2 + 1)
+worker_class = os.environ.get('WORKER_CLASS') or 'gthread'
+threads = int(os.environ.get('WORKER_THREADS') or 4)
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS') or 1000)
+keepalive = int(os.environ.get('KEEPALIVE') or 5)
+timeout = int(os.environ.get('WORKER_TIMEOUT') or 30)
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT') or 30)
+max_requests = int(os.environ.get('MAX_REQUESTS') or 10000)
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER') or 1000)
+# Each worker builds its own engine pool and hashing pool after the fork.
+preload_app = False
+accesslog = os.environ.get('ACCESS_LOG') or '-'
+
+
+def on_starting(server):
+    # The memory backends keep revocation and cache invalidation fan-out and
+    # rate-limit counters inside one process, so with several workers a user
+    # deactivated through one worker keeps a working token on the others.
+    from config import Config
+    local = [name for name in ('SHARED_STATE_BACKEND', 'RATELIMIT_BACKEND')
+             if getattr(Config, name, 'memory') == 'memory']
+    if server.cfg.workers > 1 and local:
+        raise RuntimeError(
+            f"{' and '.join(local)}: the memory backend keeps state per process, but {server.cfg.workers} "
+            "workers are configured. Set SHARED_STATE_BACKEND=redis (pip install redis), or WEB_CONCURRENCY=1."
+        )
@@ -0,0 +1,61 @@
+"""add user.deleted_at and partial unique indexes
+
+Revision ID: 4a7e2b9c1d05
+Revises: 9d4f1a6c2b83
+Create Date: 2026-10-18 20:34:12.906417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a7e2b9c1d05'
+down_revision = '9d4f1a6c2b83'
+branch_labels = None
+depends_on = None
+
+LIVE = sa.text('deleted_at IS NULL')
+DELETED = sa.text('deleted_at IS NOT NULL')
+
+# The user table predates the migrations, and create_all left its unique
+# constraints unnamed on SQLite. This names them the way Postgres did.
+NAMING = {'uq': '%(table_name)s_%(column_0_name)s_key'}
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.add_column('user', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        # Build the new indexes without blocking writes, and before dropping
+        # the old constraints so uniqueness is enforced throughout.
+        with op.get_context().autocommit_block():
+            op.create_index('uq_user_username_live', 'user', ['username'], unique=True,
+                            postgresql_where=LIVE, postgresql_concurrently=True)
+            op.create_index('uq_user_email_live', 'user', ['email'], unique=True,
+                            postgresql_where=LIVE, postgresql_concurrently=True)
+            op.create_index('ix_user_deleted_at', 'user', ['deleted_at'],
+                            postgresql_where=DELETED, postgresql_concurrently=True)
+        op.execute('ALTER TABLE "user" DROP CONSTRAINT IF EXISTS user_username_key')
+        op.execute('ALTER TABLE "user" DROP CONSTRAINT IF EXISTS user_email_key')
+        return
+
+    with op.batch_alter_table('user', schema=None, naming_convention=NAMING) as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        batch_op.drop_constraint('user_username_key', type_='unique')
+        batch_op.drop_constraint('user_email_key', type_='unique')
+        batch_op.create_index('uq_user_username_live', ['username'], unique=True, sqlite_where=LIVE)
+        batch_op.create_index('uq_user_email_live', ['email'], unique=True, sqlite_where=LIVE)
+        batch_op.create_index('ix_user_deleted_at', ['deleted_at'], sqlite_where=DELETED)
+
+
+def downgrade():
+    # The old schema cannot hold a deleted user next to a live one with the
+    # same username or email, so soft-deleted users are purged now.
+    op.execute('DELETE FROM "user" WHERE deleted_at IS NOT NULL')
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_deleted_at')
+        batch_op.drop_index('uq_user_email_live')
+        batch_op.drop_index('uq_user_username_live')
+        batch_op.create_unique_constraint('user_email_key', ['email'])
+        batch_op.create_unique_constraint('user_username_key', ['username'])
+        batch_op.drop_column('deleted_at')
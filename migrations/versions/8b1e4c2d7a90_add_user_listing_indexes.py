@@ -0,0 +1,34 @@
+"""add user listing indexes
+
+Revision ID: 8b1e4c2d7a90
+Revises: 3ce2ed54c09f
+Create Date: 2026-10-18 10:12:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b1e4c2d7a90'
+down_revision = '3ce2ed54c09f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_created_at_id', ['created_at', 'id'], unique=False)
+        batch_op.create_index('ix_user_role_active_created_at', ['role', 'active', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_user_username_prefix', ['username'], unique=False,
+                              postgresql_ops={'username': 'text_pattern_ops'})
+        batch_op.create_index('ix_user_email_prefix', ['email'], unique=False,
+                              postgresql_ops={'email': 'text_pattern_ops'})
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_email_prefix')
+        batch_op.drop_index('ix_user_username_prefix')
+        batch_op.drop_index('ix_user_role_active_created_at')
+        batch_op.drop_index('ix_user_created_at_id')
@@ -0,0 +1,62 @@
+"""add audit_event table
+
+Revision ID: 9d4f1a6c2b83
+Revises: 5e0a7c3b9f12
+Create Date: 2026-10-18 19:41:07.553210
+
+"""
+from datetime import date
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d4f1a6c2b83'
+down_revision = '5e0a7c3b9f12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # Partitioned by month so old audit data can be detached or dropped
+        # per partition; the primary key has to include the partition key.
+        op.execute("""
+            CREATE TABLE audit_event (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY,
+                created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+                user_id INTEGER,
+                actor_id INTEGER,
+                action VARCHAR(32) NOT NULL,
+                ip VARCHAR(45),
+                details JSON,
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at)
+        """)
+        op.execute("CREATE TABLE audit_event_default PARTITION OF audit_event DEFAULT")
+        today = date.today()
+        for offset in range(3):
+            month = today.month - 1 + offset
+            low = date(today.year + month // 12, month % 12 + 1, 1)
+            high = date(today.year + (month + 1) // 12, (month + 1) % 12 + 1, 1)
+            op.execute(
+                f"CREATE TABLE audit_event_y{low.year}m{low.month:02d} PARTITION OF audit_event "
+                f"FOR VALUES FROM ('{low.isoformat()}') TO ('{high.isoformat()}')"
+            )
+    else:
+        op.create_table('audit_event',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('actor_id', sa.Integer(), nullable=True),
+        sa.Column('action', sa.String(length=32), nullable=False),
+        sa.Column('ip', sa.String(length=45), nullable=True),
+        sa.Column('details', sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+    op.create_index('ix_audit_event_user_id_created_at', 'audit_event', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_audit_event_user_id_created_at', table_name='audit_event')
+    op.drop_table('audit_event')
@@ -3,11 +3,12 @@ from app import create_app, db
 app = create_app()
 
 if __name__ == '__main__':
-    try:
-        with app.app_context():
-            db.create_all()
-            print("Connected successfully")
-    except Exception as e:
-        print(f"Failed to connect: {e}")
+    if not app.config.get('PRODUCTION_MODE'):
+        try:
+            with app.app_context():
+                db.create_all()
+                print("Connected successfully")
+        except Exception as e:
+            print(f"Failed to connect: {e}")
 
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=not app.config.get('PRODUCTION_MODE'))